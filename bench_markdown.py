@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import optparse
+import sys
+import threading
+import time
+
+
+USAGE = """%prog SDK_PATH [NUMBER]
+Measure rendering throughput of concurrent requests on one instance.
+
+SDK_PATH    Path to the SDK installation
+NUMBER      Number of conversions per thread (default: 20)"""
+
+
+SAMPLE_BODY = u'\n\n'.join(u'# Section %d\n\n'
+                           u'Some *text* with [[Page %d]], a [reference][r%d] and ~~struck~~ words.\n\n'
+                           u'[r%d]: http://example.com/%d\n\n'
+                           u'*   item\n*   [ ] todo\n\n'
+                           u'| name | value |\n|------|-------|\n| a    | %d     |' % ((i,) * 6)
+                           for i in range(20))
+
+
+class LockedMarkdown(object):
+    """Single instance serialized by a lock, for comparison"""
+    def __init__(self, renderer):
+        self._renderer = renderer
+        self._lock = threading.Lock()
+
+    def convert(self, source):
+        with self._lock:
+            try:
+                return self._renderer.convert(source)
+            finally:
+                self._renderer.reset()
+
+
+def measure(renderer, threads, number, expected):
+    """Returns conversions per second and number of wrong or failed conversions"""
+    failures = [0]
+
+    def work():
+        for _ in range(number):
+            try:
+                if renderer.convert(SAMPLE_BODY) != expected:
+                    failures[0] += 1
+            except Exception:
+                failures[0] += 1
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    started_at = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return threads * number / (time.time() - started_at), failures[0]
+
+
+def main(sdk_path, number):
+    if 'lib' not in sys.path:
+        sys.path.insert(0, 'lib')
+
+    sys.path.insert(0, sdk_path)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+
+    from models.utils import MarkdownPool, new_markdown
+    expected = new_markdown().convert(SAMPLE_BODY)
+
+    cases = [
+        ('shared instance (unsafe)', new_markdown),
+        ('shared instance with lock', lambda: LockedMarkdown(new_markdown())),
+        ('pool', MarkdownPool),
+    ]
+    for threads in [1, 2, 4, 8]:
+        for name, make_renderer in cases:
+            per_sec, failures = measure(make_renderer(), threads, number, expected)
+            print '%d threads  %-28s %8.1f conversions/sec  %4d failures' % (threads, name, per_sec, failures)
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser(USAGE)
+    options, args = parser.parse_args()
+    if len(args) < 1:
+        print 'Error: SDK_PATH required.'
+        parser.print_help()
+        sys.exit(1)
+    main(args[0], int(args[1]) if len(args) > 1 else 20)
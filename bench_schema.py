@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import optparse
+import sys
+import timeit
+
+
+USAGE = """%prog SDK_PATH [NUMBER]
+Measure cost of a single schema lookup on the hot path of rendering data.
+
+SDK_PATH    Path to the SDK installation
+NUMBER      Number of lookups to time (default: 10000)"""
+
+
+def scan_legacy_spellings(schema):
+    """Legacy spelling scan which used to run on every property lookup, for comparison"""
+    props = schema.get_schema_set()['properties']
+    return {pname for pname, pdata in props.items() if 'comment' in pdata and pdata['comment'].find('(legacy spelling;') != -1}
+
+
+def main(sdk_path, number):
+    if 'lib' not in sys.path:
+        sys.path.insert(0, 'lib')
+
+    sys.path.insert(0, sdk_path)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+
+    from google.appengine.ext import testbed
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.init_memcache_stub()
+
+    import schema
+    schema.get_registry()
+
+    cases = [
+        ('get_property', lambda: schema.get_property('author'), number),
+        ('humane_property', lambda: schema.humane_property('Book', 'author'), number),
+        ('humane_property (reversed)', lambda: schema.humane_property('Person', 'parent', True), number),
+        ('get_schema', lambda: schema.get_schema('Book'), number),
+        ('get_itemtype_path', lambda: schema.get_itemtype_path('Book'), number),
+        # the scan is a few hundred times slower, so time fewer of them
+        ('legacy spelling scan (before)', lambda: 'author' in scan_legacy_spellings(schema), max(1, number // 100)),
+    ]
+    for name, func, n in cases:
+        sec = min(timeit.repeat(func, number=n, repeat=3))
+        print '%-32s %10.3f usec/lookup' % (name, sec / n * 1000000)
+
+    bed.deactivate()
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser(USAGE)
+    options, args = parser.parse_args()
+    if len(args) < 1:
+        print 'Error: SDK_PATH required.'
+        parser.print_help()
+        sys.exit(1)
+    main(args[0], int(args[1]) if len(args) > 1 else 10000)
@@ -1,5 +1,13 @@
 # -*- coding: utf-8 -*-
+import time
+import zlib
+import uuid
+import random
+import hashlib
+import cPickle
+import logging
 import threading
+from collections import OrderedDict
 from google.appengine.api import memcache
 
 
@@ -7,7 +15,52 @@ c = memcache.Client()
 
 
 prc = None
-max_recent_users = 20
+max_recent_changes = 50
+
+# values larger than this are stored compressed, in chunks under the memcache item limit
+compress_min_bytes = 4 * 1024
+chunk_bytes = 900 * 1000
+
+# single-flight fills: how long a lease lasts, and how long others wait for it
+lease_sec = 10
+lease_wait_sec = 2.0
+lease_poll_sec = 0.05
+
+# wikiquery results of superseded generations are never read again, so they expire.
+# results with data of redirect targets aren't invalidated when the targets change
+wikiquery_exp_sec = 24 * 60 * 60
+wikiquery_redirect_exp_sec = 60
+
+# generated sections of a page which are rendered and cached separately
+fragment_names = ['inlinks', 'related_links', 'other_posts']
+
+# families of per-page keys ('model\t<family>\t<title>')
+page_families = ['rendered_body', 'render_version', 'data', 'metadata', 'hashbangs'] + \
+                ['rendered_fragment\t%s' % name for name in fragment_names]
+
+# key prefixes which can be cached in process memory, and their families
+local_families = [
+    ('model\tconfig', 'config'),
+    ('model\ttitles\t', 'titles'),
+    ('model\tmigration\t', 'migration'),
+]
+
+
+# families of keys for statistics, matched by prefix in this order
+stats_families = [
+    'model\trendered_body', 'model\trendered_fragment', 'model\trender_version',
+    'model\tdata', 'model\tmetadata', 'model\thashbangs', 'model\twikiquery',
+    'model\ttitles', 'model\tterm_generation', 'model\tconfig', 'model\tmigration',
+    'shadow', 'chunk',
+]
+stats_names = ['prc_hits', 'local_hits', 'memcache_hits', 'stale_hits', 'misses',
+               'sets', 'set_bytes', 'deletes', 'errors', 'rpcs', 'rpc_msec']
+stats_shards = 8
+stats_flush_sec = 10
+
+
+# marks keys known to be missing in memcache during current request
+_missing = object()
 
 
 class PerRequestCache(threading.local):
@@ -24,6 +77,108 @@ class PerRequestCache(threading.local):
         self.__dict__.clear()
 
 
+class _Packed(object):
+    """Header of a pickled value. Large values are compressed and keep their data in chunk keys named after its digest"""
+    compressed = True
+
+    def __init__(self, digest, blob=None, chunks=0, compressed=True):
+        self.digest = digest
+        self.blob = blob
+        self.chunks = chunks
+        self.compressed = compressed
+
+    def chunk_keys(self):
+        return ['chunk\t%s\t%d' % (self.digest, i) for i in range(self.chunks)]
+
+
+class LocalCache(object):
+    """Bounded LRU cache shared by all requests of an instance.
+
+    Each entry remembers the generation of its family when it was stored and
+    is valid only while the generation in memcache stays the same."""
+    def __init__(self, max_size=500, ttl_sec=600):
+        self._max_size = max_size
+        self._ttl_sec = ttl_sec
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, generation):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            expires_at, entry_generation, pickled = entry
+            if entry_generation != generation or expires_at < time.time():
+                return None
+            self._entries[key] = entry
+        return cPickle.loads(pickled)
+
+    def set(self, key, value, generation):
+        # store pickled to keep callers from sharing mutable values across requests
+        entry = (time.time() + self._ttl_sec, generation, cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def flush_all(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class CacheStats(object):
+    """Counters of an instance per key family.
+
+    They are added to sharded memcache counters every `stats_flush_sec`
+    so that recording never costs an RPC of its own."""
+    def __init__(self):
+        self._counts = {}
+        self._registered = set()
+        self._flushed_at = time.time()
+        self._lock = threading.Lock()
+
+    def add(self, family, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self._counts[(family, name)] = self._counts.get((family, name), 0) + delta
+        if time.time() - self._flushed_at > stats_flush_sec:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            counts, self._counts = self._counts, {}
+            self._flushed_at = time.time()
+        if not counts:
+            return
+
+        try:
+            families = {family for family, _ in counts}
+            if not families.issubset(self._registered):
+                registered = set(c.get('stats\tfamilies') or [])
+                if not families.issubset(registered):
+                    c.set('stats\tfamilies', sorted(registered | families))
+                self._registered = registered | families
+
+            mapping = dict(('%s\t%s' % key, delta) for key, delta in counts.items())
+            c.offset_multi(mapping, key_prefix='stats\t%d\t' % random.randrange(stats_shards), initial_value=0)
+        except:
+            pass
+
+    def flush_all(self):
+        with self._lock:
+            self._counts = {}
+            self._registered = set()
+
+
+local = LocalCache()
+stats = CacheStats()
+
+
 def create_prc():
     global prc
     prc = PerRequestCache()
@@ -33,170 +188,197 @@ if prc is None:
     create_prc()
 
 
+# functions which clear structures of an instance derived from cached data
+_flush_callbacks = []
+
+
+def on_flush_all(callback):
+    _flush_callbacks.append(callback)
+
+
 def flush_all():
     prc.flush_all()
+    local.flush_all()
+    stats.flush_all()
+    for callback in _flush_callbacks:
+        callback()
     c.flush_all()
 
 
-def add_recent_email(email):
-    emails = get_recent_emails()
-    if len(emails) > 0 and emails[-1] == email:
-        return
-    if email in emails:
-        emails.remove(email)
-    emails.append(email)
-    value = emails[-max_recent_users:]
-    _set_cache('view\trecentemails', value)
-
-
-def get_recent_emails():
-    key = 'view\trecentemails'
+def get_stats():
+    """Returns counters of all instances as {family: {name: value}}"""
+    stats.flush()
     try:
-        emails = c.get(key)
-        if emails is None:
-            c.flush_all()
-            emails = []
-        return emails
+        families = c.get('stats\tfamilies') or []
+        keys = dict(('stats\t%d\t%s\t%s' % (shard, family, name), (family, name))
+                    for shard in range(stats_shards) for family in families for name in stats_names)
+        values = c.get_multi(keys.keys())
     except:
-        return []
+        return {}
+
+    result = dict((family, OrderedDict((name, 0) for name in stats_names)) for family in families)
+    for key, value in values.items():
+        family, name = keys[key]
+        result[family][name] += int(value)
+    return result
 
 
-def set_titles(email, content):
+def get_store_failures():
+    """Number of values which couldn't be stored in memcache even after compression"""
     try:
-        add_recent_email(email)
-        c.set('model\ttitles\t%s' % email, content)
+        return c.get('stats\tstore_failures') or 0
     except:
-        pass
+        return 0
 
 
-def get_titles(email):
+def add_recent_change(change):
+    """Prepend a change to the write-through list of recent changes"""
+    key = 'model\trecent_changes'
     try:
-        return c.get('model\ttitles\t%s' % email)
+        for _ in range(3):
+            changes = c.gets(key)
+            if changes is None:
+                if c.add(key, [change]):
+                    return
+            elif c.cas(key, ([change] + changes)[:max_recent_changes]):
+                return
     except:
         pass
 
 
-def del_titles():
+def get_recent_changes():
     try:
-        emails = get_recent_emails()
-        keys = ['model\ttitles\t%s' % email
-                for email in emails + ['None']]
-        c.delete_multi(keys)
+        return c.get('model\trecent_changes') or []
     except:
-        pass
-
-
-def set_schema_set(value):
-    _set_cache('schema_set', value)
-
-
-def set_schema(key, value):
-    _set_cache('schema\t%s' % key, value)
-
+        return []
 
-def set_schema_itemtypes(value):
-    _set_cache('schema\titemtypes', value)
 
+def get_titles_version():
+    """Version of the title catalog. Bumping it replaces deleting catalogs of every reader"""
+    key = 'model\ttitles_version'
+    version = prc.get(key)
+    if version is not None:
+        return version
+    try:
+        version = c.get(key)
+        if version is None:
+            c.add(key, int(time.time() * 1000))
+            version = c.get(key)
+    except:
+        return None
+    if version is not None:
+        prc.set(key, version)
+    return version
 
-def set_schema_selectable_itemtypes(value):
-    _set_cache('schema\tselectable_itemtypes', value)
 
+def set_title_catalog(version, catalog):
+    _set_cache('model\ttitles\t%s' % version, catalog)
 
-def set_schema_property(prop_name, prop):
-    _set_cache('schema\tprop\t%s' % prop_name, prop)
 
+def get_title_catalog(version):
+    return _get_cache('model\ttitles\t%s' % version)
 
-def set_schema_datatype(type_name, prop):
-    _set_cache('schema\tdatatype\t%s' % type_name, prop)
 
-def set_cardinalities(key, data):
+def del_titles():
+    key = 'model\ttitles_version'
     try:
-        return c.set('schema\tcardinalities\t%s' % key, data)
+        prc.set(key, c.incr(key, initial_value=int(time.time() * 1000)))
     except:
-        pass
+        prc.set(key, None)
+
 
 def set_config(value):
     _set_cache('model\tconfig', value)
 
 
-def set_rendered_body(title, value):
-    if not value:
-        return
-
-    _set_cache('model\trendered_body\t%s' % title, value)
-
-
-def set_wikiquery(q, email, value):
-    # adaptive expiration time
-    exp_sec = 60
-    if type(value) == list:
-        if len(value) < 2:
-            exp_sec = 60
-        elif len(value) < 10:
-            exp_sec = 60 * 5
-        elif len(value) < 100:
-            exp_sec = 60 * 60
-        elif len(value) < 500:
-            exp_sec = 60 * 60 * 24
-
-    _set_cache('model\twikiquery\t%s\t%s' % (q, email), value, exp_sec)
+def set_migration(name, value):
+    _set_cache('model\tmigration\t%s' % name, value)
 
 
-def set_data(title, value):
-    _set_cache('model\tdata\t%s' % title, value)
-
+def set_rendered_body(title, value, shadow_key=None):
+    if not value:
+        return
 
-def set_metadata(title, value):
-    _set_cache('model\tmetadata\t%s' % title, value)
+    _set_cache('model\trendered_body\t%s' % title, value, shadow_key=shadow_key)
 
 
-def set_hashbangs(title, value):
-    _set_cache('model\thashbangs\t%s' % title, value)
+def set_rendered_fragment(title, name, value):
+    _set_cache('model\trendered_fragment\t%s\t%s' % (name, title), value)
 
 
+def fill_rendered_body(title, render):
+    """Cached rendered body of a page as (body, stale). At most one request renders it at a time"""
+    return _get_or_fill('model\trendered_body\t%s' % title, render,
+                        lambda value, shadow_key: set_rendered_body(title, value, shadow_key))
 
 
-def get_schema_set():
-    return _get_cache('schema_set')
+def fill_wikiquery(q, email, terms, evaluate):
+    """Cached result of a wikiquery. At most one request evaluates it at a time.
 
+    The key includes generations of the (name, value) terms of the query and
+    the title catalog version, so the result lives until a page which matches
+    one of its terms, the set of readable titles or .config changes. Lease and
+    shadow are kept per (q, email), so the previous result is served while the
+    new one is evaluated.
 
-def get_schema(key):
-    return _get_cache('schema\t%s' % key)
+    evaluate returns (result, redirected), where redirected tells if the result
+    has data of redirect targets. Such results expire soon."""
+    fill_key = _wikiquery_fill_key(q, email)
+    key = _wikiquery_key(fill_key, terms)
 
+    def store(value, shadow_key):
+        exp_sec = wikiquery_redirect_exp_sec if value[1] else wikiquery_exp_sec
+        _set_cache(key, value, exp_sec, shadow_key)
 
-def get_schema_itemtypes():
-    return _get_cache('schema\titemtypes')
+    return _get_or_fill(key, evaluate, store, fill_key)[0][0]
 
 
-def get_schema_selectable_itemtypes():
-    return _get_cache('schema\tselectable_itemtypes')
+def del_wikiquery_terms(terms):
+    """Invalidate cached wikiqueries which depend on any of given (name, value) terms"""
+    if not terms:
+        return
+    try:
+        c.set_multi(dict((_term_key(name, value), uuid.uuid4().hex) for name, value in terms))
+    except:
+        pass
 
 
-def get_schema_property(prop_name):
-    return _get_cache('schema\tprop\t%s' % prop_name)
+def set_data(title, value):
+    _set_cache('model\tdata\t%s' % title, value)
 
 
-def get_schema_datatype(type_name):
-    return _get_cache('schema\tdatatype\t%s' % type_name)
+def set_metadata(title, value):
+    _set_cache('model\tmetadata\t%s' % title, value)
 
 
-def get_cardinalities(key):
-    try:
-        return c.get('schema\tcardinalities\t%s' % key)
-    except:
-        pass
+def set_hashbangs(title, value):
+    _set_cache('model\thashbangs\t%s' % title, value)
 
 
 def get_config():
     return _get_cache('model\tconfig')
 
 
+def get_migration(name):
+    return _get_cache('model\tmigration\t%s' % name)
+
+
 def get_rendered_body(title):
     return _get_cache('model\trendered_body\t%s' % title)
 
 
-def get_wikiquery(q, email):
-    return _get_cache('model\twikiquery\t%s\t%s' % (q, email))
+def get_rendered_fragment(title, name):
+    return _get_cache('model\trendered_fragment\t%s\t%s' % (name, title))
+
+
+def get_render_version(title):
+    """Opaque version of generated sections of a page. Changes whenever its fragments are invalidated"""
+    key = 'model\trender_version\t%s' % title
+    version = _get_cache(key)
+    if version is None:
+        version = uuid.uuid4().hex[:12]
+        _set_cache(key, version)
+    return version
 
 
 def get_data(title):
@@ -215,10 +397,18 @@ def del_config():
     _del_cache('model\tconfig')
 
 
+def del_migration(name):
+    _del_cache('model\tmigration\t%s' % name)
+
+
 def del_rendered_body(title):
     _del_cache('model\trendered_body\t%s' % title)
 
 
+def del_render_version(title):
+    _del_cache('model\trender_version\t%s' % title)
+
+
 def del_data(title):
     _del_cache('model\tdata\t%s' % title)
 
@@ -231,26 +421,327 @@ def del_hashbangs(title):
     _del_cache('model\thashbangs\t%s' % title)
 
 
-def _set_cache(key, value, exp_sec=0):
+def del_rendered_fragments(titles, names):
+    """Delete given fragments of pages and their stitched bodies"""
+    del_pages(titles, ['rendered_body', 'render_version'] + ['rendered_fragment\t%s' % name for name in names])
+
+
+def prefetch_pages(titles, families=page_families):
+    """Load cached values of pages into the per-request cache with one RPC"""
+    _get_cache_multi(_page_keys(titles, families))
+
+
+def del_pages(titles, families=page_families):
+    _del_cache_multi(_page_keys(titles, families))
+
+
+def _page_keys(titles, families):
+    return ['model\t%s\t%s' % (family, title) for title in titles for family in families]
+
+
+def _wikiquery_fill_key(q, email):
+    return u'model\twikiquery\t%s\t%s' % (q, email)
+
+
+def _wikiquery_key(fill_key, terms):
+    # default permissions in .config decide readable titles too
+    generations = _get_term_generations(terms) + [get_titles_version(), get_render_version(u'.config')]
+    digest = hashlib.md5(repr(generations)).hexdigest()
+    return u'%s\t%s' % (fill_key, digest)
+
+
+def _term_key(name, value):
+    return u'model\tterm_generation\t%s\t%s' % (name, value)
+
+
+def _get_term_generations(terms):
+    keys = [_term_key(name, value) for name, value in sorted(terms)]
+    if not keys:
+        return []
+    try:
+        values = c.get_multi(keys)
+        missing = [key for key in keys if key not in values]
+        if missing:
+            # unknown or evicted generation: start a new one so that no cached query matches
+            c.add_multi(dict((key, uuid.uuid4().hex) for key in missing))
+            values.update(c.get_multi(missing))
+        return [values.get(key) for key in keys]
+    except:
+        return [uuid.uuid4().hex]
+
+
+def _set_cache(key, value, exp_sec=0, shadow_key=None):
+    """Cache value under key. If shadow_key is given, the same packed value is stored under it too"""
     try:
         prc.set(key, value)
-        c.set(key, value, exp_sec)
+        _set_local(key, value)
     except:
         pass
+    _store({key: value}, exp_sec, {shadow_key: key} if shadow_key is not None else None)
+
+
+def _store(mapping, exp_sec=0, copies=None):
+    """Store values in memcache, compressing and chunking large ones, and count values which can't be stored.
+
+    copies maps extra keys to keys of mapping, whose packed values and chunks they share."""
+    failed = set()
+    headers = {}
+    chunks = {}
+    for key, value in mapping.items():
+        try:
+            header, value_chunks, size = _pack(value)
+        except Exception:
+            failed.add(key)
+            continue
+        stats.add(_stats_family(key), sets=1, set_bytes=size)
+        headers[key] = header
+        chunks.update((chunk_key, (key, chunk)) for chunk_key, chunk in value_chunks.items())
+    for copy_key, key in (copies or {}).items():
+        if key in headers:
+            stats.add(_stats_family(copy_key), sets=1)
+            headers[copy_key] = headers[key]
+        else:
+            failed.add(copy_key)
+
+    # store chunks first so that a header never points to chunks which failed
+    if chunks:
+        failed.update(chunks[chunk_key][0] for chunk_key in _set_multi(dict((k, v[1]) for k, v in chunks.items()), exp_sec))
+        failed.update(copy_key for copy_key, key in (copies or {}).items() if key in failed)
+    headers = dict((key, header) for key, header in headers.items() if key not in failed)
+    if headers:
+        failed.update(_set_multi(headers, exp_sec))
+
+    if failed:
+        for key in failed:
+            stats.add(_stats_family(key), errors=1)
+        logging.warning('Failed to store in memcache: %s' % ', '.join(sorted(failed)))
+        try:
+            c.incr('stats\tstore_failures', len(failed), initial_value=0)
+        except:
+            pass
+
+
+def _set_multi(mapping, exp_sec):
+    """Returns keys which failed to be stored"""
+    try:
+        return _rpc(mapping.keys(), c.set_multi, mapping, exp_sec)
+    except Exception:
+        return mapping.keys()
+
+
+def _rpc(keys, method, *args):
+    """Call a memcache method, recording its latency for families of keys"""
+    started = time.time()
+    try:
+        return method(*args)
+    finally:
+        msec = int((time.time() - started) * 1000)
+        for family in {_stats_family(key) for key in keys}:
+            stats.add(family, rpcs=1, rpc_msec=msec)
+
+
+def _stats_family(key):
+    for prefix in stats_families:
+        if key.startswith(prefix):
+            return prefix
+    return 'other'
+
+
+def _pack(value):
+    """Returns what to store under the key of value, chunks to store along with it and its stored size.
+
+    Small strings are stored as they are. Other values are pickled once, and
+    their bytes are kept as they are or compressed depending on the length."""
+    if value is None or isinstance(value, (bool, int, long, float)):
+        return value, {}, 8
+    if isinstance(value, basestring) and len(value) < compress_min_bytes:
+        return value, {}, len(value)
+    pickled = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+    if len(pickled) < compress_min_bytes:
+        return _Packed(None, blob=pickled, compressed=False), {}, len(pickled)
+
+    blob = zlib.compress(pickled)
+    digest = hashlib.md5(blob).hexdigest()
+    if len(blob) <= chunk_bytes:
+        return _Packed(digest, blob=blob), {}, len(blob)
+
+    header = _Packed(digest, chunks=(len(blob) + chunk_bytes - 1) // chunk_bytes)
+    return header, dict((chunk_key, blob[i * chunk_bytes:(i + 1) * chunk_bytes])
+                        for i, chunk_key in enumerate(header.chunk_keys())), len(blob)
+
+
+def _unpack(value):
+    """Returns the original value of a stored one, or None if its chunks are lost or corrupted"""
+    if not isinstance(value, _Packed):
+        return value
+    if not value.compressed:
+        return cPickle.loads(value.blob)
+
+    if value.chunks == 0:
+        blob = value.blob
+    else:
+        keys = value.chunk_keys()
+        chunks = c.get_multi(keys)
+        if len(chunks) != len(keys):
+            return None
+        blob = ''.join(chunks[key] for key in keys)
+
+    if hashlib.md5(blob).hexdigest() != value.digest:
+        return None
+    return cPickle.loads(zlib.decompress(blob))
 
 
 def _get_cache(key):
-    if prc.get(key) is None:
+    family = _stats_family(key)
+    value = prc.get(key)
+    if value is not None:
+        stats.add(family, **{'misses' if value is _missing else 'prc_hits': 1})
+    else:
         try:
-            prc.set(key, c.get(key))
+            value = _get_local(key)
+            if value is not None:
+                stats.add(family, local_hits=1)
+            else:
+                value = _unpack(_rpc([key], c.get, key))
+                stats.add(family, **{'misses' if value is None else 'memcache_hits': 1})
+                _set_local(key, value)
+            prc.set(key, _missing if value is None else value)
+        except:
+            stats.add(family, errors=1)
+
+    value = prc.get(key)
+    return None if value is _missing else value
+
+
+def _get_or_fill(key, fill, store, fill_key=None):
+    """Get value of key as (value, stale), or fill and store it while holding a lease.
+
+    The first request which misses takes a short lease with add() and fills
+    the value. Others serve the previous value kept under a shadow key, with
+    stale set to True, or wait for the lease holder for a while and fill it
+    by themselves if it takes too long.
+
+    Lease and shadow are kept under fill_key if given, which stays the same
+    while key changes with versions of the value. store(value, shadow_key)
+    should store the filled value under both keys, packing it once."""
+    value = _get_cache(key)
+    if value is not None:
+        return value, False
+
+    if fill_key is None:
+        fill_key = key
+    lease_key = 'lease\t%s' % fill_key
+    shadow_key = 'shadow\t%s' % fill_key
+    try:
+        leased = c.add(lease_key, 1, lease_sec)
+    except:
+        leased = False
+
+    if not leased:
+        try:
+            value = _unpack(c.get(shadow_key))
+            if value is not None:
+                stats.add(_stats_family(key), stale_hits=1)
+                return value, True
+
+            deadline = time.time() + lease_wait_sec
+            while time.time() < deadline:
+                time.sleep(lease_poll_sec)
+                value = _unpack(c.get(key))
+                if value is not None:
+                    prc.set(key, value)
+                    return value, False
         except:
             pass
-    return prc.get(key)
+
+    try:
+        value = fill()
+        store(value, shadow_key)
+        return value, False
+    finally:
+        if leased:
+            try:
+                c.delete(lease_key)
+            except:
+                pass
+
+
+def _get_cache_multi(keys):
+    keys = [key for key in keys if prc.get(key) is None]
+    if not keys:
+        return
+
+    try:
+        values = _rpc(keys, c.get_multi, keys)
+        for key in keys:
+            value = _unpack(values.get(key))
+            prc.set(key, _missing if value is None else value)
+    except:
+        for family in {_stats_family(key) for key in keys}:
+            stats.add(family, errors=1)
 
 
 def _del_cache(key):
+    _del_cache_multi([key])
+
+
+def _del_cache_multi(keys):
+    if not keys:
+        return
+
+    for key in keys:
+        stats.add(_stats_family(key), deletes=1)
     try:
-        prc.set(key, None)
-        c.delete(key)
+        for key in keys:
+            prc.set(key, None)
+            local.delete(key)
+        _bump_generations({_local_family(key) for key in keys}.difference([None]))
+        _rpc(keys, c.delete_multi, keys)
     except:
-        pass
+        for family in {_stats_family(key) for key in keys}:
+            stats.add(family, errors=1)
+
+
+def _local_family(key):
+    for prefix, family in local_families:
+        if key.startswith(prefix):
+            return family
+    return None
+
+
+def _get_local(key):
+    family = _local_family(key)
+    if family is None:
+        return None
+    return local.get(key, _get_generations()[family])
+
+
+def _set_local(key, value):
+    family = _local_family(key)
+    if family is None or value is None:
+        return
+    local.set(key, value, _get_generations()[family])
+
+
+def _get_generations():
+    """Generations of all local families, fetched with one RPC per request"""
+    generations = prc.get('\tgenerations')
+    if generations is None:
+        keys = dict(('generation\t%s' % family, family) for _, family in local_families)
+        values = c.get_multi(keys.keys())
+        for key in set(keys).difference(values):
+            # unknown or evicted generation: start a new one so that no local entry matches
+            c.add(key, uuid.uuid4().hex)
+            values[key] = c.get(key)
+        generations = dict((family, values[key]) for key, family in keys.items())
+        prc.set('\tgenerations', generations)
+    return generations
+
+
+def _bump_generations(families):
+    if not families:
+        return
+    generations = _get_generations()
+    values = dict(('generation\t%s' % family, uuid.uuid4().hex) for family in families)
+    c.set_multi(values)
+    generations.update((family, values['generation\t%s' % family]) for family in families)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+import optparse
+import sys
+
+
+USAGE = """%prog SDK_PATH
+Compile schema files into schema.compiled, which is loaded faster than them.
+Run again before deploying whenever schema files change.
+
+SDK_PATH    Path to the SDK installation"""
+
+
+def main(sdk_path):
+    if 'lib' not in sys.path:
+        sys.path.insert(0, 'lib')
+
+    sys.path.insert(0, sdk_path)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+
+    import schema
+    schema.write_compiled_schema()
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser(USAGE)
+    options, args = parser.parse_args()
+    if len(args) < 1:
+        print 'Error: SDK_PATH required.'
+        parser.print_help()
+        sys.exit(1)
+    main(args[0])
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import os
 import sys
 import ext
 import webapp2
@@ -9,6 +10,13 @@ if 'lib' not in sys.path:
 
 VERSION = '0.0.1_20140628_0'
 
+# report time spent in each phase of every request with Server-Timing header.
+# admins can profile a single request with `_profile` parameter.
+PROFILE_REQUESTS = False
+
+# count RPCs of each request and log call sites which look up entities one by one
+AUDIT_RPCS = os.environ.get('SERVER_SOFTWARE', '').startswith('Development')
+
 DEFAULT_CONFIG = {
     'navigation': [
         {
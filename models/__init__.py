@@ -3,8 +3,12 @@
 from utils import *
 from toc_generator import TocGenerator
 from conflict_error import ConflictError
+from storage_migration import StorageMigration
 from user_preferences import UserPreferences
 from page_operation_mixin import PageOperationMixin
 from wiki_page_revision import WikiPageRevision
+from wiki_page_data import WikiPageData
+from schema_data_posting import SchemaDataPosting
 from schema_data_index import SchemaDataIndex
+from wiki_link import WikiLink
 from wiki_page import WikiPage
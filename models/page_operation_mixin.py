@@ -6,6 +6,7 @@ import yaml
 import schema
 import operator
 import urllib2
+import profiler
 from collections import OrderedDict
 from yaml.parser import ParserError
 from lxml.html.clean import Cleaner
@@ -274,6 +275,7 @@ class PageOperationMixin(object):
         return body[:max_length - 3].strip() + u'...'
 
     @staticmethod
+    @profiler.timed('sanitize')
     def sanitize_html(rendered):
         if rendered:
             cleaner = Cleaner(safe_attrs_only=False)
@@ -448,46 +450,24 @@ class PageOperationMixin(object):
 
     @classmethod
     def render_body(cls, title, body, rendered_data='', inlinks={}, related_links_by_score={}, older_title=None, newer_title=None):
-        # body
-        body_parts = [cls.remove_metadata(body)]
-
-        # incoming links
-        if len(inlinks) > 0:
-            lines = [u'# Incoming Links']
-            for i, (rel, links) in enumerate(inlinks.items()):
-                itemtype, rel = rel.split('/')
-                lines.append(u'## %s <span class="hidden">(%s %d)</span>' % (schema.humane_property(itemtype, rel, True), itemtype, i))
-                # remove dups and sort
-                links = list(set(links))
-                links.sort()
-
-                lines += [u'* [[%s]]' % t for t in links]
-            body_parts.append(u'\n'.join(lines))
-
-        # related links
-        related_links = related_links_by_score
-        if len(related_links) > 0:
-            lines = [u'# Suggested Pages']
-            lines += [u'* {{.score::%.3f}} [[%s]]\n{.noli}' % (score, t)
-                      for t, score in related_links.items()[:10]]
-            body_parts.append(u'\n'.join(lines))
-            body_parts.append(u'* [More suggestions...](/+%s)\n{.more-suggestions}' % (cls.title_to_path(title)))
-
-        # other posts
-        if older_title or newer_title:
-            lines = [u'# Other Posts']
-            if newer_title:
-                lines.append(u'* {{.newer::newer}} [[%s]]\n{.noli}' % newer_title)
-            if older_title:
-                lines.append(u'* {{.older::older}} [[%s]]\n{.noli}' % older_title)
-            body_parts.append(u'\n'.join(lines))
-
-        # remove yaml/schema block
-        joined = u'\n'.join(body_parts)
-        joined = re.sub(PageOperationMixin.re_yaml_schema, u'\n', joined)
+        parts = [cls.render_main_body(body, rendered_data)] + [
+            cls.render_fragment(markdown) for markdown in (
+                cls.inlinks_fragment(inlinks),
+                cls.related_links_fragment(title, related_links_by_score),
+                cls.other_posts_fragment(older_title, newer_title),
+            )
+        ]
+        return u'\n'.join(part for part in parts if part)
+
+    @classmethod
+    def render_main_body(cls, body, rendered_data=''):
+        # remove metadata and yaml/schema block
+        body = cls.remove_metadata(body)
+        body = re.sub(PageOperationMixin.re_yaml_schema, u'\n', body)
 
         # render to html
-        rendered = md.convert(joined)
+        with profiler.phase('markdown'):
+            rendered = md.convert(body)
 
         # add table of contents
         rendered = TocGenerator(rendered).add_toc()
@@ -498,3 +478,52 @@ class PageOperationMixin(object):
         # add structured data block
         rendered = rendered_data + rendered
         return cls.sanitize_html(rendered)
+
+    @classmethod
+    def render_fragment(cls, markdown):
+        """Render generated section appended to the main body. Headings get anchors but no table of contents"""
+        if not markdown:
+            return u''
+        with profiler.phase('markdown'):
+            rendered = md.convert(markdown)
+        rendered = TocGenerator(rendered).add_anchors()
+        return cls.sanitize_html(rendered)
+
+    @staticmethod
+    def inlinks_fragment(inlinks):
+        if len(inlinks) == 0:
+            return u''
+
+        lines = [u'# Incoming Links']
+        for i, (rel, links) in enumerate(inlinks.items()):
+            itemtype, rel = rel.split('/')
+            lines.append(u'## %s <span class="hidden">(%s %d)</span>' % (schema.humane_property(itemtype, rel, True), itemtype, i))
+            # remove dups and sort
+            links = list(set(links))
+            links.sort()
+
+            lines += [u'* [[%s]]' % t for t in links]
+        return u'\n'.join(lines)
+
+    @staticmethod
+    def related_links_fragment(title, related_links_by_score):
+        if len(related_links_by_score) == 0:
+            return u''
+
+        lines = [u'# Suggested Pages']
+        lines += [u'* {{.score::%.3f}} [[%s]]\n{.noli}' % (score, t)
+                  for t, score in related_links_by_score.items()[:10]]
+        lines.append(u'* [More suggestions...](/+%s)\n{.more-suggestions}' % (PageOperationMixin.title_to_path(title)))
+        return u'\n'.join(lines)
+
+    @staticmethod
+    def other_posts_fragment(older_title, newer_title):
+        if not (older_title or newer_title):
+            return u''
+
+        lines = [u'# Other Posts']
+        if newer_title:
+            lines.append(u'* {{.newer::newer}} [[%s]]\n{.noli}' % newer_title)
+        if older_title:
+            lines.append(u'* {{.older::older}} [[%s]]\n{.noli}' % older_title)
+        return u'\n'.join(lines)
@@ -1,62 +1,113 @@
 # -*- coding: utf-8 -*-
 import schema
+import caching
+import hashlib
 from google.appengine.ext import ndb
+from models import StorageMigration, SchemaDataPosting, WikiPageData
 
 
 class SchemaDataIndex(ndb.Model):
+    key_migration = u'data_index_keys'
+
     title = ndb.StringProperty()
     name = ndb.StringProperty()
     value = ndb.StringProperty()
 
+    @classmethod
+    def create(cls, title, name, v):
+        value = cls.index_value(v)
+        return cls(key=cls.key_for(title, name, value), title=title, name=name, value=value)
+
+    @classmethod
+    def key_for(cls, title, name, v):
+        row_id = hashlib.md5(u'\t'.join([title, name, cls.index_value(v)]).encode('utf-8')).hexdigest()
+        return ndb.Key(cls, row_id)
+
     @classmethod
     def rebuild_index(cls, title, data):
+        new_pairs = cls.index_pairs(data)
+        new_keys = {cls.key_for(title, name, value) for name, value in new_pairs}
+
+        # rows of stored data are read by key, since a query may not see them yet
+        snapshot = WikiPageData.key_for(title).get()
+        snapshot_pairs = cls.index_pairs(snapshot.data) if snapshot is not None and snapshot.data else set()
+        rows = ndb.get_multi([cls.key_for(title, name, value) for name, value in snapshot_pairs])
+        rows = [row for row in rows if row is not None]
+        if not StorageMigration.is_finished(cls.key_migration):
+            # rows written before deterministic keys can only be found by query
+            rows += cls.query_by_title(title).fetch(projection=[cls.name, cls.value])
+        old_pairs = {(row.name, row.value) for row in rows}
+
         # delete
-        keys = [i.key for i in cls.query_by_title(title).fetch()]
-        ndb.delete_multi(keys)
+        ndb.delete_multi(list({row.key for row in rows if row.key not in new_keys}))
 
         # insert
-        entities = [cls(title=title, name=name, value=unicode(v.pvalue if isinstance(v, schema.Property) else v))
-                    for name, v in cls.data_as_pairs(data)
-                    if not isinstance(v, schema.Property) or v.should_index()]
+        entities = [cls.create(title, name, value) for name, value in new_pairs]
         ndb.put_multi(entities)
 
+        SchemaDataPosting.update(title, new_pairs, old_pairs.difference(new_pairs))
+        caching.del_wikiquery_terms(old_pairs | new_pairs)
+
     @classmethod
     def update_index(cls, title, old_data, new_data):
-        old_pairs = cls.data_as_pairs(old_data)
-        new_pairs = cls.data_as_pairs(new_data)
+        old_pairs = cls.index_pairs(old_data)
+        new_pairs = cls.index_pairs(new_data)
 
         deletes = old_pairs.difference(new_pairs)
         inserts = new_pairs.difference(old_pairs)
 
         # delete
-        queries = [cls.query(cls.title == title, cls.name == name, cls.value == unicode(v.pvalue if isinstance(v, schema.Property) else v))
-                   for name, v in deletes
-                   if not isinstance(v, schema.Property) or v.should_index()]
-
-        entities = reduce(lambda a, b: a + b, [q.fetch() for q in queries], [])
-        keys = [e.key for e in entities]
+        keys = [cls.key_for(title, name, value) for name, value in deletes]
+        if not StorageMigration.is_finished(cls.key_migration):
+            # rows written before deterministic keys can only be found by query
+            queries = [cls.query(cls.title == title, cls.name == name, cls.value == value)
+                       for name, value in deletes]
+            keys += reduce(lambda a, b: a + b, [q.fetch(keys_only=True) for q in queries], [])
         if len(keys) > 0:
             ndb.delete_multi(keys)
 
         # insert
-        entities = [cls(title=title, name=name, value=unicode(v.pvalue if isinstance(v, schema.Property) else v))
-                    for name, v in inserts
-                    if not isinstance(v, schema.Property) or v.should_index()]
-
+        entities = [cls.create(title, name, value) for name, value in inserts]
         if len(entities) > 0:
             ndb.put_multi(entities)
 
+        SchemaDataPosting.update(title, inserts, deletes)
+
+        # every query this page matches, before or after, may show its data
+        caching.del_wikiquery_terms(old_pairs | new_pairs)
+
     @classmethod
     def query_by_title(cls, title):
         return cls.query(cls.title == title)
 
     @classmethod
     def query_titles(cls, name, v):
-        return [i.title for i in cls.query(cls.name == name, cls.value == unicode(v.pvalue if isinstance(v, schema.Property) else v))]
+        """Returns sorted titles of pages which have `v` as their `name` property"""
+        if StorageMigration.is_finished(SchemaDataPosting.migration):
+            titles = SchemaDataPosting.get_titles(name, cls.index_value(v))
+            if titles is not None:
+                return titles
+        return sorted(i.title for i in cls.query(cls.name == name, cls.value == cls.index_value(v)))
 
     @classmethod
     def has_match(cls, title, name, v):
-        return cls.query(cls.title == title, cls.name == name, cls.value == unicode(v.pvalue if isinstance(v, schema.Property) else v)).count() > 0
+        if cls.key_for(title, name, v).get() is not None:
+            return True
+        if StorageMigration.is_finished(cls.key_migration):
+            return False
+        return cls.query(cls.title == title, cls.name == name, cls.value == cls.index_value(v)).count() > 0
+
+    @staticmethod
+    def index_value(v):
+        return unicode(v.pvalue if isinstance(v, schema.Property) else v)
+
+    @staticmethod
+    def should_index(v):
+        return not isinstance(v, schema.Property) or v.should_index()
+
+    @classmethod
+    def index_pairs(cls, data):
+        return {(name, cls.index_value(v)) for name, v in cls.data_as_pairs(data) if cls.should_index(v)}
 
     @staticmethod
     def data_as_pairs(data):
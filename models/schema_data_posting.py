@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import zlib
+import json
+import heapq
+import bisect
+import hashlib
+import logging
+from google.appengine.ext import ndb
+
+
+class SchemaDataPosting(ndb.Model):
+    """Sorted titles of pages which have `value` as their `name` property, in one shard of them.
+
+    Titles are spread over `shard_count` entities by a hash of the title, so that
+    updates of pages with a common term don't write to one entity group. A shard
+    which would grow over `max_bytes` isn't written any more and is marked as
+    overflowed, and titles of its term are read from SchemaDataIndex instead."""
+    migration = u'data_postings'
+    shard_count = 16
+
+    # entities are limited to 1MB
+    max_bytes = 900 * 1000
+
+    name = ndb.StringProperty(indexed=False)
+    value = ndb.StringProperty(indexed=False)
+    titles = ndb.JsonProperty(compressed=True)
+    overflowed = ndb.BooleanProperty(indexed=False, default=False)
+
+    @classmethod
+    def key_for(cls, name, value, shard):
+        posting_id = hashlib.md5(u'\t'.join([name, value]).encode('utf-8')).hexdigest()
+        return ndb.Key(cls, '%s-%d' % (posting_id, shard))
+
+    @classmethod
+    def shard_of(cls, title):
+        return int(hashlib.md5(title.encode('utf-8')).hexdigest()[:8], 16) % cls.shard_count
+
+    @classmethod
+    def get_titles(cls, name, value):
+        """Returns sorted titles, or None if a shard has overflowed"""
+        postings = ndb.get_multi([cls.key_for(name, value, shard) for shard in range(cls.shard_count)])
+        postings = [posting for posting in postings if posting is not None]
+        if any(posting.overflowed for posting in postings):
+            return None
+        return list(heapq.merge(*[posting.titles for posting in postings]))
+
+    @classmethod
+    def update(cls, title, inserts, deletes):
+        """Adds title to postings of `inserts` pairs and removes it from those of `deletes`"""
+        futures = [cls._update_async(title, name, value, True) for name, value in inserts]
+        futures += [cls._update_async(title, name, value, False) for name, value in deletes]
+        [f.get_result() for f in futures]
+
+    @classmethod
+    @ndb.transactional_tasklet
+    def _update_async(cls, title, name, value, add):
+        key = cls.key_for(name, value, cls.shard_of(title))
+        posting = yield key.get_async()
+        if posting is None:
+            posting = cls(key=key, name=name, value=value, titles=[])
+        if add and posting.overflowed:
+            return
+
+        titles = posting.titles
+        index = bisect.bisect_left(titles, title)
+        found = index < len(titles) and titles[index] == title
+        if add and not found:
+            titles.insert(index, title)
+            if cls._is_too_large(titles):
+                del titles[index]
+                posting.overflowed = True
+                logging.warning(u'Posting of %s=%s is too large with %d titles in a shard. '
+                                u'Its titles will be read from data index' % (name, value, len(titles)))
+        elif not add and found:
+            del titles[index]
+        else:
+            return
+
+        if titles or posting.overflowed:
+            yield posting.put_async()
+        else:
+            yield key.delete_async()
+
+    @classmethod
+    def _is_too_large(cls, titles):
+        encoded = json.dumps(titles)
+        # compressed json is smaller, so compress only when it may be too large
+        if len(encoded) < cls.max_bytes:
+            return False
+        return len(zlib.compress(encoded)) >= cls.max_bytes
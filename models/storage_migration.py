@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+import caching
+from datetime import datetime
+from google.appengine.ext import ndb
+
+
+class StorageMigration(ndb.Model):
+    finished_at = ndb.DateTimeProperty()
+
+    @classmethod
+    def is_finished(cls, name):
+        finished = caching.get_migration(name)
+        if finished is None:
+            finished = cls.get_by_id(name) is not None
+            caching.set_migration(name, finished)
+        return finished
+
+    @classmethod
+    def finish(cls, name):
+        cls(id=name, finished_at=datetime.now()).put()
+        caching.del_migration(name)
+
+    @classmethod
+    def reset(cls, name):
+        ndb.Key(cls, name).delete()
+        caching.del_migration(name)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import re
 import hashlib
+import profiler
 
 
 class TocGenerator(object):
@@ -22,13 +23,22 @@ class TocGenerator(object):
         except ValueError as e:
             return e.message
 
+    @profiler.timed('toc')
     def add_toc(self):
         """Add table of contents to HTML"""
+        return self._add_anchors(with_toc=True)
+
+    @profiler.timed('toc')
+    def add_anchors(self):
+        """Add anchors to headings without table of contents"""
+        return self._add_anchors(with_toc=False)
+
+    def _add_anchors(self, with_toc):
         headings = TocGenerator.extract_headings(self._html)
         outlines = self.generate_outline(headings)
         paths = self.generate_path(outlines)
 
-        if len(headings) > 4:
+        if with_toc and len(headings) > 4:
             toc = u'<div class="toc"><h1>Table of Contents</h1>' \
                   u'%s</div>' % self._generate_toc(outlines, iter(paths))
         else:
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
-import caching
 import markdown
+from contextlib import contextmanager
 from markdown.extensions.def_list import DefListExtension
 from markdown.extensions.attr_list import AttrListExtension
 from markdownext import md_url, md_wikilink, md_itemprop, md_mathjax, md_strikethrough, md_tables, md_partials, md_section, md_embed
@@ -109,8 +109,6 @@ def get_cur_user():
         except oauth.OAuthRequestError:
             pass
 
-    if user is not None:
-        caching.add_recent_email(user.email())
     return user
 
 
@@ -130,20 +128,58 @@ def is_admin_user(user):
     return False
 
 
-md = markdown.Markdown(
-    extensions=[
-        md_wikilink.WikiLinkExtension(),
-        md_itemprop.ItemPropExtension(),
-        md_url.URLExtension(),
-        md_mathjax.MathJaxExtension(),
-        md_strikethrough.StrikethroughExtension(),
-        md_partials.PartialsExtension(),
-        md_tables.TableExtension(),
-        md_section.SectionExtension(),
-        md_embed.EmbedExtension(),
-        DefListExtension(),
-        AttrListExtension(),
-    ],
-    safe_mode=False,
-    smart_emphasis=False,
-)
+def new_markdown():
+    """Markdown instance with the extensions of this wiki"""
+    return markdown.Markdown(
+        extensions=[
+            md_wikilink.WikiLinkExtension(),
+            md_itemprop.ItemPropExtension(),
+            md_url.URLExtension(),
+            md_mathjax.MathJaxExtension(),
+            md_strikethrough.StrikethroughExtension(),
+            md_partials.PartialsExtension(),
+            md_tables.TableExtension(),
+            md_section.SectionExtension(),
+            md_embed.EmbedExtension(),
+            DefListExtension(),
+            AttrListExtension(),
+        ],
+        safe_mode=False,
+        smart_emphasis=False,
+    )
+
+
+class MarkdownPool(object):
+    """Idle Markdown instances, one of which is checked out for each conversion.
+
+    Markdown keeps parser state while converting, so concurrent requests of a
+    threadsafe instance can't share one. A new instance is made only when all
+    are busy, so there are at most as many as concurrent conversions.
+    list.pop() and list.append() are atomic, so checkout takes no lock."""
+    def __init__(self, factory=new_markdown):
+        self._factory = factory
+        self._idle = []
+
+    def convert(self, source):
+        with self.checkout() as renderer:
+            return renderer.convert(source)
+
+    @contextmanager
+    def checkout(self):
+        try:
+            renderer = self._idle.pop()
+        except IndexError:
+            renderer = self._factory()
+
+        try:
+            yield renderer
+        finally:
+            # don't let references and stashed html leak into next conversion
+            renderer.reset()
+            self._idle.append(renderer)
+
+    def idle_count(self):
+        return len(self._idle)
+
+
+md = MarkdownPool()
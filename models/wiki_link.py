@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import hashlib
+from google.appengine.ext import ndb
+
+
+class WikiLink(ndb.Model):
+    """An edge of the link graph: page `source` links to page `target` as `rel`.
+    Edges are root entities, so that edits of pages linking the same page don't
+    write to one entity group. Inlinks are read with an eventually consistent
+    query on target."""
+    source = ndb.StringProperty()
+    rel = ndb.StringProperty()
+    target = ndb.StringProperty()
+
+    @classmethod
+    def create(cls, source, rel, target):
+        return cls(key=cls.key_for(source, rel, target), source=source, rel=rel, target=target)
+
+    @classmethod
+    def key_for(cls, source, rel, target):
+        edge_id = hashlib.md5(u'\t'.join([source, rel, target]).encode('utf-8')).hexdigest()
+        return ndb.Key(cls, edge_id)
+
+    @classmethod
+    def query_inlinks(cls, target):
+        return cls.query(cls.target == target)
+
+    @classmethod
+    def query_outlinks(cls, source):
+        return cls.query(cls.source == source)
+
+    @classmethod
+    @ndb.tasklet
+    def get_inlinks_async(cls, target):
+        """Returns inlinks of target page as {rel: [sorted source titles]}"""
+        links = {}
+        edges = yield cls.query_inlinks(target).fetch_async()
+        for edge in edges:
+            links.setdefault(edge.rel, []).append(edge.source)
+        for sources in links.values():
+            sources.sort()
+        raise ndb.Return(links)
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import re
+import acl
 import yaml
 import main
 import random
@@ -15,7 +16,7 @@ from datetime import datetime
 from google.appengine.ext import deferred
 from markdownext import md_wikilink
 
-from models import PageOperationMixin, ConflictError, WikiPageRevision, TocGenerator, SchemaDataIndex
+from models import PageOperationMixin, ConflictError, WikiPageRevision, TocGenerator, SchemaDataIndex, SchemaDataPosting, StorageMigration, WikiLink, WikiPageData
 from models import is_admin_user, md
 from models.utils import merge_dicts
 
@@ -27,6 +28,11 @@ class WikiPage(ndb.Model, PageOperationMixin):
     re_normalize_title = re.compile(ur'([\[\]\(\)\~\!\@\#\$\%\^\&\*\-'
                                     ur'\=\+\\:\;\'\"\,\.\?\<\>\s]|'
                                     ur'\bthe\b|\ban?\b)')
+    title_key_migration = u'root_title_keys'
+    fragment_names = caching.fragment_names
+
+    # True once rendered_body has returned the previous body while another request renders it
+    stale_body_served = False
 
     itemtype_path = ndb.StringProperty()
     title = ndb.StringProperty()
@@ -37,7 +43,7 @@ class WikiPage(ndb.Model, PageOperationMixin):
     modifier = ndb.UserProperty()
     acl_read = ndb.StringProperty()
     acl_write = ndb.StringProperty()
-    inlinks = ndb.JsonProperty()
+    legacy_inlinks = ndb.JsonProperty('inlinks')
     outlinks = ndb.JsonProperty()
     related_links = ndb.JsonProperty()
     updated_at = ndb.DateTimeProperty()
@@ -53,25 +59,53 @@ class WikiPage(ndb.Model, PageOperationMixin):
 
     @property
     def rendered_body(self):
-        value = caching.get_rendered_body(self.title)
+        body, stale = caching.fill_rendered_body(self.title, self._render_body)
+        # a stale body is of a previous revision, so it must not get validators of current one
+        self.stale_body_served = self.stale_body_served or stale
+        return body
+
+    def _render_body(self):
+        parts = [self.rendered_main_body] + [self._rendered_fragment(name) for name in WikiPage.fragment_names]
+        return u'\n'.join(part for part in parts if part)
+
+    @property
+    def rendered_main_body(self):
+        snapshot = self.data_snapshot
+        if snapshot and snapshot.html is not None:
+            return snapshot.html
+        return PageOperationMixin.render_main_body(self.body, self.rendered_data)
+
+    def _rendered_fragment(self, name):
+        value = caching.get_rendered_fragment(self.title, name)
         if value is None:
-            value = super(WikiPage, self).rendered_body
-            caching.set_rendered_body(self.title, value)
+            if name == 'inlinks':
+                markdown = PageOperationMixin.inlinks_fragment(self.inlinks)
+            elif name == 'related_links':
+                markdown = PageOperationMixin.related_links_fragment(self.title, self.related_links_by_score)
+            else:
+                markdown = PageOperationMixin.other_posts_fragment(self.older_title, self.newer_title)
+            value = PageOperationMixin.render_fragment(markdown)
+            caching.set_rendered_fragment(self.title, name, value)
         return value
 
     @property
     def data(self):
-        value = caching.get_data(self.title)
-        if value is None:
-            value = super(WikiPage, self).data
-            caching.set_data(self.title, value)
+        packed = caching.get_data(self.title)
+        if packed is not None:
+            return schema.unpack_data(packed)
+
+        snapshot = self.data_snapshot
+        value = snapshot.data if snapshot else super(WikiPage, self).data
+        caching.set_data(self.title, schema.pack_data(value))
         return value
 
     @property
     def metadata(self):
         value = caching.get_metadata(self.title)
         if value is None:
-            value = super(WikiPage, self).metadata
+            # parsing leading metadata lines is cheaper than loading the snapshot, unless it's loaded already
+            snapshot = getattr(self, '_data_snapshot', None)
+            value = snapshot.metadata if snapshot else super(WikiPage, self).metadata
             caching.set_metadata(self.title, value)
         return value
 
@@ -79,14 +113,31 @@ class WikiPage(ndb.Model, PageOperationMixin):
     def hashbangs(self):
         value = caching.get_hashbangs(self.title)
         if value is None:
-            value = super(WikiPage, self).hashbangs
+            snapshot = self.data_snapshot
+            value = snapshot.hashbangs if snapshot else PageOperationMixin.extract_hashbangs(self.rendered_main_body)
             caching.set_hashbangs(self.title, value)
         return value
 
+    @property
+    def data_snapshot(self):
+        """Parsed data stored when current revision was saved. None if there is no usable one"""
+        if getattr(self, '_data_snapshot', None) is None:
+            snapshot = WikiPageData.key_for(self.title).get() if self.revision > 0 else None
+            if snapshot is None or snapshot.revision != self.revision or snapshot.metadata is None:
+                snapshot = False
+            self._data_snapshot = snapshot
+        return self._data_snapshot or None
+
     @property
     def revisions(self):
         return WikiPageRevision.query(ancestor=self._rev_key())
 
+    @property
+    def inlinks(self):
+        if getattr(self, '_inlinks', None) is None:
+            self._set_inlinks(WikiLink.get_inlinks_async(self.title).get_result())
+        return self._inlinks
+
     @property
     def link_scoretable(self):
         """Returns all links ordered by score"""
@@ -138,12 +189,14 @@ class WikiPage(ndb.Model, PageOperationMixin):
             raise RuntimeError('Only admin can delete pages.')
 
         self.update_content('', self.revision, user=user, dont_create_rev=True, dont_defer=True)
-        self._update_inlinks({}, {'relatedTo': [p[0] for p in self.paths[:-1]]})
+        self._update_inlinks_async({}, self.outlinks).get_result()
         self.related_links = {}
         self.modifier = None
         self.updated_at = None
         self.revision = 0
+        WikiPageData.delete_by_title(self.title)
         self.put()
+        caching.add_recent_change(self._recent_change())
 
         ndb.delete_multi(r.key for r in self.revisions)
 
@@ -210,6 +263,9 @@ class WikiPage(ndb.Model, PageOperationMixin):
         # validate and prepare new contents
         new_data, new_md = self.validate_new_content(base_revision, body, user)
         new_body = self._merge_if_needed(base_revision, body)
+        if new_body != body:
+            new_md = PageOperationMixin.parse_metadata(new_body)
+            new_data = PageOperationMixin.parse_data(self.title, new_body, new_md['schema'])
 
         # get old data and metadata
         try:
@@ -223,12 +279,13 @@ class WikiPage(ndb.Model, PageOperationMixin):
             old_data = {}
 
         # delete caches
-        caching.del_rendered_body(self.title)
-        caching.del_hashbangs(self.title)
-        caching.del_metadata(self.title)
-        caching.del_data(self.title)
+        caching.del_pages([self.title])
+        if self.published_to:
+            caching.del_render_version(self.published_to)
+        self._data_snapshot = False
 
         # update model and save
+        old_acl = (self.acl_read, self.acl_write)
         self.body = new_body
         self.modifier = user
         self.description = PageOperationMixin.make_description(new_body)
@@ -241,7 +298,11 @@ class WikiPage(ndb.Model, PageOperationMixin):
             self.revision += 1
         if not force_update:
             self.updated_at = now
+        # stored snapshot is trusted to be of current revision, so delete it before
+        # the page is saved. it's stored again after that
+        WikiPageData.delete_by_title(self.title)
         self.put()
+        caching.add_recent_change(self._recent_change())
 
         # create revision
         if not dont_create_rev:
@@ -252,6 +313,9 @@ class WikiPage(ndb.Model, PageOperationMixin):
                                    acl_read=self.acl_read, acl_write=self.acl_write)
             rev.put()
 
+        # store parsed data and rendered main body so that reads don't have to parse the body again
+        self._build_data_snapshot(new_data, new_md).put()
+
         # update inlinks, outlinks and schema data index
         self.update_links_and_data(old_md.get('redirect'), new_md.get('redirect'), old_data, new_data, dont_defer)
 
@@ -259,12 +323,23 @@ class WikiPage(ndb.Model, PageOperationMixin):
         if self.title == '.config':
             caching.del_config()
 
-        # delete title cache if it's a new page
-        if self.revision == 1:
+        # delete title catalog if it's a new page or its acl has been changed
+        if self.revision == 1 or old_acl != (self.acl_read, self.acl_write):
             caching.del_titles()
 
         return True
 
+    def _build_data_snapshot(self, data, metadata):
+        data = data.copy()
+        data['datePageModified'] = schema.DateTimeProperty(metadata['schema'], 'DateTime', 'datePageModified', self.updated_at)
+        snapshot = WikiPageData(key=WikiPageData.key_for(self.title), revision=self.revision, data=data, metadata=metadata)
+
+        # render with the new snapshot to reuse parsed data
+        self._data_snapshot = snapshot
+        snapshot.html = PageOperationMixin.render_main_body(self.body, self.rendered_data)
+        snapshot.hashbangs = PageOperationMixin.extract_hashbangs(snapshot.html)
+        return snapshot
+
     def _merge_if_needed(self, base_revision, new_body):
         if self.revision == base_revision:
             return new_body
@@ -323,43 +398,56 @@ class WikiPage(ndb.Model, PageOperationMixin):
             deferred.defer(self.update_links, old_redir, new_redir)
             deferred.defer(SchemaDataIndex.update_index, self.title, old_data, new_data)
 
-    def _update_redirected_links(self, new_redir, old_redir):
+    @ndb.tasklet
+    def _update_redirected_links_async(self, new_redir, old_redir):
         """Change in/out links of self and related pages according to new redirect metadata"""
         if old_redir == new_redir:
             return
 
-        source = WikiPage.get_by_title(old_redir, follow_redirect=True) if old_redir else self
+        redirs = [r for r in (old_redir, new_redir) if r]
+        redir_pages = dict(zip(redirs, (yield WikiPage.get_by_titles_async(redirs))))
+        source = redir_pages[old_redir] if old_redir else self
         if len(source.inlinks) == 0:
             return
 
-        target = WikiPage.get_by_title(new_redir, follow_redirect=True) if new_redir else self
+        target = redir_pages[new_redir] if new_redir else self
 
-        updates = [source, target]
-        for rel, titles in source.inlinks.items():
+        source_inlinks = source.inlinks
+        yield WikiPage._migrate_legacy_inlinks_async([source])
+        linkers = yield WikiPage._get_link_pages_async(source_inlinks, follow_redirect=False)
+        pages = {}
+        added = []
+        removed = []
+        for rel, titles in source_inlinks.items():
             for t in titles:
-                page = WikiPage.get_by_title(t)
+                page = pages.setdefault(t, linkers[t])
                 page.del_outlink(source.title, rel)
                 page.add_outlink(target.title, rel)
-                updates.append(page)
+                removed.append(WikiLink.key_for(t, rel, source.title))
+                added.append(WikiLink.create(t, rel, target.title))
 
-            target.add_inlinks(source.inlinks[rel], rel)
-            del source.inlinks[rel]
-
-        ndb.put_multi(updates)
-        for page in updates:
-            caching.del_rendered_body(page.title)
-            caching.del_hashbangs(page.title)
+        updates = pages.values()
+        yield ndb.put_multi_async(updates + added) + ndb.delete_multi_async(removed)
+        source._set_inlinks(None)
+        target._set_inlinks(None)
+        caching.del_rendered_fragments([p.title for p in [source, target] + updates], ['inlinks'])
 
     def update_links(self, old_redir, new_redir):
         """Updates outlinks of this page and inlinks of target pages"""
+        self.update_links_async(old_redir, new_redir).get_result()
+
+    @ndb.tasklet
+    def update_links_async(self, old_redir, new_redir):
         # 1. process "redirect" metadata
-        self._update_redirected_links(new_redir, old_redir)
+        yield self._update_redirected_links_async(new_redir, old_redir)
 
         # 2. update inlinks
         cur_outlinks = self.outlinks
+        parsed_outlinks = self._parse_outlinks()
+        targets = yield WikiPage._get_link_pages_async(parsed_outlinks)
         new_outlinks = {}
-        for rel, titles in self._parse_outlinks().items():
-            new_outlinks[rel] = list({WikiPage.get_by_title(t, follow_redirect=True).title for t in titles})
+        for rel, titles in parsed_outlinks.items():
+            new_outlinks[rel] = list({targets[t].title for t in titles})
 
         if self.acl_read:
             # delete all inlinks of target pages if the source page has a read restriction
@@ -378,47 +466,42 @@ class WikiPage(ndb.Model, PageOperationMixin):
                 if rel in new_outlinks:
                     removed_outlinks[rel] = set(removed_outlinks[rel]).difference(new_outlinks[rel])
 
-        self._update_inlinks(added_outlinks, removed_outlinks)
+        yield self._update_inlinks_async(added_outlinks, removed_outlinks)
 
         # 3. update outlinks of this page
         [new_outlinks[rel].sort() for rel in new_outlinks.keys()]
         self.outlinks = new_outlinks
-        self.put()
-
-    def _update_inlinks(self, added_outlinks, removed_outlinks):
-        # handle added links
-        updates = []
-        for rel, titles in added_outlinks.items():
-            for title in titles:
-                page = WikiPage.get_by_title(title, follow_redirect=True)
-                page.add_inlink(self.title, rel)
-                updates.append(page)
-
-        if updates:
-            ndb.put_multi(updates)
-            for page in updates:
-                caching.del_rendered_body(page.title)
-                caching.del_hashbangs(page.title)
-
-        # handle removed links
-        updates = []
-        deletes = []
-        for rel, titles in removed_outlinks.items():
-            for title in titles:
-                page = WikiPage.get_by_title(title, follow_redirect=True)
-                page.del_inlink(self.title, rel)
-                if len(page.inlinks) == 0 and page.revision == 0 and page.key:
-                    deletes.append(page.key)
-                else:
-                    updates.append(page)
-
-        if updates:
-            ndb.put_multi(updates)
-        if deletes:
-            ndb.delete_multi(deletes)
-        for page in updates + deletes:
-            caching.del_rendered_body(page.title)
-            caching.del_hashbangs(page.title)
+        yield self.put_async()
+
+    @ndb.tasklet
+    def _update_inlinks_async(self, added_outlinks, removed_outlinks):
+        titles = set()
+        for links in (added_outlinks, removed_outlinks):
+            for link_titles in links.values():
+                titles.update(link_titles)
+        titles = list(titles)
+        targets = dict(zip(titles, (yield WikiPage.get_by_titles_async(titles))))
+
+        # links stored in legacy json field can only be removed after moving them to edges
+        yield WikiPage._migrate_legacy_inlinks_async([targets[t] for ts in removed_outlinks.values() for t in ts])
+
+        added = {}
+        for rel, link_titles in added_outlinks.items():
+            for t in link_titles:
+                edge = WikiLink.create(self.title, rel, targets[t].title)
+                added[edge.key] = edge
+        removed = set()
+        for rel, link_titles in removed_outlinks.items():
+            for t in link_titles:
+                removed.add(WikiLink.key_for(self.title, rel, targets[t].title))
+        removed.difference_update(added.keys())
+
+        yield ndb.put_multi_async(added.values()) + ndb.delete_multi_async(list(removed))
+
+        pages = {page.title: page for page in targets.values()}.values()
+        for page in pages:
+            page._set_inlinks(None)
+        caching.del_rendered_fragments([page.title for page in pages], ['inlinks'])
 
     def _update_pub_state(self, new_md, old_md):
         pub_old = u'pub' in old_md
@@ -453,27 +536,19 @@ class WikiPage(ndb.Model, PageOperationMixin):
         if save:
             self.put()
 
-        caching.del_rendered_body(self.title)
-        caching.del_hashbangs(self.title)
-        if self.newer_title:
-            caching.del_rendered_body(self.newer_title)
-            caching.del_hashbangs(self.newer_title)
-        if self.older_title:
-            caching.del_rendered_body(self.older_title)
-            caching.del_hashbangs(self.older_title)
+        titles = [t for t in (self.title, self.newer_title, self.older_title) if t]
+        caching.del_rendered_fragments(titles, ['other_posts'])
+        if self.published_to:
+            caching.del_render_version(self.published_to)
 
     def _unpublish(self, save):
         if self.published_at is None:
             return
 
-        caching.del_rendered_body(self.title)
-        caching.del_hashbangs(self.title)
-        if self.newer_title:
-            caching.del_rendered_body(self.newer_title)
-            caching.del_hashbangs(self.newer_title)
-        if self.older_title:
-            caching.del_rendered_body(self.older_title)
-            caching.del_hashbangs(self.older_title)
+        titles = [t for t in (self.title, self.newer_title, self.older_title) if t]
+        caching.del_rendered_fragments(titles, ['other_posts'])
+        if self.published_to:
+            caching.del_render_version(self.published_to)
 
         older = WikiPage.get_by_title(self.older_title)
         newer = WikiPage.get_by_title(self.newer_title)
@@ -501,14 +576,22 @@ class WikiPage(ndb.Model, PageOperationMixin):
     def get_similar_titles(self, user):
         return WikiPage.similar_titles(WikiPage.get_titles(user), self.title)
 
-    def update_related_links(self, max_distance=5):
-        """Update related_links score table by random walk"""
+    def update_related_links(self, max_distance=5, touched=None):
+        """Update related_links score table by random walk.
+
+        Related links of pages on the walk are updated too. They're added to
+        `touched` ({title: page}) if given, and caller should put them and delete
+        their related_links fragments. Otherwise it's done here."""
         if len(self.outlinks) == 0:
             return False
 
         # random walk
         score_table = self.related_links
-        updated = WikiPage._update_related_links(self, self, 0.1, score_table, max_distance)
+        walked = {} if touched is None else touched
+        updated = WikiPage._update_related_links(self, self, 0.1, score_table, max_distance, walked)
+        if touched is None and walked:
+            ndb.put_multi(walked.values())
+            caching.del_rendered_fragments(walked.keys(), ['related_links'])
         if not updated:
             return False
 
@@ -571,24 +654,23 @@ class WikiPage(ndb.Model, PageOperationMixin):
         return dict((k, v) for k, v in merged.items()
                     if not((type(v) == list and self.title in v) or self.title == v))
 
-    def add_inlinks(self, titles, rel):
-        WikiPage._add_inout_links(self.inlinks, titles, rel)
-
     def add_outlinks(self, titles, rel):
         WikiPage._add_inout_links(self.outlinks, titles, rel)
 
-    def add_inlink(self, title, rel):
-        WikiPage._add_inout_link(self.inlinks, title, rel)
-
     def add_outlink(self, title, rel):
         WikiPage._add_inout_link(self.outlinks, title, rel)
 
-    def del_inlink(self, title, rel=None):
-        WikiPage._del_inout_link(self.inlinks, title, rel)
-
     def del_outlink(self, title, rel=None):
         WikiPage._del_inout_link(self.outlinks, title, rel)
 
+    def _set_inlinks(self, edges):
+        if edges is None:
+            self._inlinks = None
+        elif self.legacy_inlinks:
+            self._inlinks = merge_dicts([edges, self.legacy_inlinks], sort_values=True, force_list=True)
+        else:
+            self._inlinks = edges
+
     def _rev_key(self):
         return ndb.Key(u'revision', self.title)
 
@@ -624,8 +706,9 @@ class WikiPage(ndb.Model, PageOperationMixin):
 
         # evaluate
         pos, neg = parsed['pos'], parsed['neg']
-        pos_pages = [cls.get_by_title(t, True) for t in pos]
-        neg_pages = [cls.get_by_title(t, True) for t in neg]
+        pos_pages = cls.get_by_titles(pos)
+        neg_pages = cls.get_by_titles(neg)
+        cls._prefetch_inlinks(pos_pages + neg_pages)
         scoretable = search.evaluate(
             dict((page.title, page.link_scoretable) for page in pos_pages),
             dict((page.title, page.link_scoretable) for page in neg_pages)
@@ -643,14 +726,17 @@ class WikiPage(ndb.Model, PageOperationMixin):
         if len(titles) > iteration:
             titles = random.sample(titles, iteration)
 
-        pages = [cls.get_by_title(title, follow_redirect=True) for title in titles]
-        updates = [p for p in pages if p.update_related_links()]
-        ndb.put_multi(updates)
+        pages = cls.get_by_titles(titles)
+        touched = {}
+        updates = [p for p in pages if p.update_related_links(touched=touched)]
+        touched.update((p.title, p) for p in updates)
+        ndb.put_multi(touched.values())
+        caching.del_rendered_fragments(touched.keys(), ['related_links'])
 
         return titles
 
     @classmethod
-    def _update_related_links(cls, start_page, page, score, score_table, distance):
+    def _update_related_links(cls, start_page, page, score, score_table, distance, touched):
         if distance == 0:
             return False
 
@@ -677,14 +763,21 @@ class WikiPage(ndb.Model, PageOperationMixin):
             next_page_score = next_score
             next_page.related_links[start_page.title] += next_page_score
             next_page.normalize_related_links()
-            next_page.put()
+            # pages on the walk are put together when it's done
+            touched[next_page.title] = next_page
 
-        cls._update_related_links(start_page, next_page, next_score, score_table, distance - 1)
+        cls._update_related_links(start_page, next_page, next_score, score_table, distance - 1, touched)
         return True
 
     @classmethod
     def get_index(cls, user=None):
-        q = WikiPage.query(ancestor=WikiPage._key())
+        default_permission = WikiPage.get_default_permission()
+        return [page for page in cls._get_index_pages()
+                if page.can_read(user, default_permission)]
+
+    @classmethod
+    def _get_index_pages(cls):
+        q = WikiPage.query()
 
         pages = q.order(WikiPage.title).fetch(projection=[
             WikiPage.title,
@@ -693,31 +786,42 @@ class WikiPage(ndb.Model, PageOperationMixin):
             WikiPage.comment,
             WikiPage.modifier,
             WikiPage.updated_at])
-
-        default_permission = WikiPage.get_default_permission()
-        return [page for page in pages
-                if page.updated_at and page.can_read(user, default_permission)]
+        pages = sorted(cls._merge_recent_changes(pages), key=operator.attrgetter('title'))
+        return [page for page in pages if page.updated_at]
 
     @classmethod
     def get_titles(cls, user=None):
-        email = user.email() if user is not None else u'None'
-        titles = caching.get_titles(email)
-        if titles is None:
-            titles = {page.title for page in cls.get_index(user)}
-            caching.set_titles(email, titles)
-
+        default_permission = WikiPage.get_default_permission()
+        titles = set()
+        for (acl_read, acl_write), acl_titles in cls.get_title_catalog().items():
+            if acl.ACL(default_permission, acl_read, acl_write).can_read(user):
+                titles.update(acl_titles)
         return titles
 
+    @classmethod
+    def get_title_catalog(cls):
+        """Titles of all pages grouped by (acl_read, acl_write), shared by every reader"""
+        version = caching.get_titles_version()
+        catalog = caching.get_title_catalog(version) if version is not None else None
+        if catalog is None:
+            catalog = {}
+            for page in cls._get_index_pages():
+                acl_key = (page.acl_read or u'', page.acl_write or u'')
+                catalog.setdefault(acl_key, []).append(page.title)
+            if version is not None:
+                caching.set_title_catalog(version, catalog)
+        return catalog
+
     @classmethod
     def get_posts_of(cls, title, index=0, count=50):
-        q = cls.query(ancestor=cls._key())
+        q = cls.query()
         q = q.filter(cls.published_to == title)
         q = q.filter(cls.published_at != None)
         return list(q.order(-cls.published_at).fetch(offset=index * count, limit=count))
 
     @classmethod
     def get_changes(cls, user, index=0, count=50):
-        q = WikiPage.query(ancestor=WikiPage._key())
+        q = WikiPage.query()
         q = q.filter(WikiPage.updated_at != None)
 
         prjs = [
@@ -730,38 +834,89 @@ class WikiPage(ndb.Model, PageOperationMixin):
         ]
         q = q.order(-WikiPage.updated_at)
         pages = q.fetch(projection=prjs, limit=count, offset=index * count)
+        if index == 0:
+            pages = [page for page in cls._merge_recent_changes(pages) if page.updated_at]
+            pages = sorted(pages, key=operator.attrgetter('updated_at'), reverse=True)[:count]
+
         default_permission = WikiPage.get_default_permission()
         return [page for page in pages if page.can_read(user, default_permission)]
 
+    def _recent_change(self):
+        return {
+            'title': self.title,
+            'updated_at': self.updated_at,
+            'modifier': self.modifier,
+            'comment': self.comment,
+            'acl_read': self.acl_read,
+            'acl_write': self.acl_write,
+        }
+
+    @classmethod
+    def _merge_recent_changes(cls, pages):
+        """Overlay changes written through memcache on results of an eventually consistent query"""
+        pages = OrderedDict((page.title, page) for page in pages)
+        seen = set()
+        for change in caching.get_recent_changes():
+            title = change['title']
+            if title in seen:
+                continue
+            seen.add(title)
+
+            page = pages.get(title)
+            if page is not None and page.updated_at and change['updated_at'] and page.updated_at >= change['updated_at']:
+                continue
+            pages[title] = WikiPage(**change)
+        return pages.values()
+
     @classmethod
     def wikiquery(cls, q, user=None):
         email = user.email() if user is not None else 'None'
-        results = caching.get_wikiquery(q, email)
-        if results is None:
-            page_query, attrs, sort_criteria = search.parse_wikiquery(q)
-            titles = cls._evaluate_pages(page_query)
-            accessible_titles = sorted(WikiPage.get_titles(user).intersection(titles))
-
-            # evaluate
-            results = []
-            if attrs == [u'name']:
-                results += [{u'name': title} for title in accessible_titles]
-            else:
-                for title in accessible_titles:
-                    pagedata = WikiPage.get_by_title(title, follow_redirect=True).data
-                    results.append(OrderedDict((attr, pagedata[attr] if attr in pagedata else None) for attr in attrs))
+        page_query, attrs, sort_criteria = search.parse_wikiquery(q)
+        terms = cls._page_query_terms(page_query)
+        return caching.fill_wikiquery(q, email, terms,
+                                      lambda: cls._evaluate_wikiquery(page_query, attrs, sort_criteria, user))
+
+    @classmethod
+    def _evaluate_wikiquery(cls, page_query, attrs, sort_criteria, user):
+        titles = cls._evaluate_pages(page_query)
+        accessible_titles = sorted(WikiPage.get_titles(user).intersection(titles))
+
+        # evaluate
+        results = []
+        redirected = []
+        if attrs == [u'name']:
+            results += [{u'name': title} for title in accessible_titles]
+        else:
+            for pagedata in WikiPage.get_data_by_titles(accessible_titles, redirected):
+                results.append(OrderedDict((attr, pagedata[attr] if attr in pagedata else None) for attr in attrs))
+
+        # sort: only use first criterion
+        if len(sort_criteria) > 0:
+            criterion = sort_criteria[0][0]
+            descending = sort_criteria[0][1] == '-'
+            results = sorted(results, key=lambda r: r[criterion].pvalue, reverse=descending)
 
-            # sort: only use first criterion
-            if len(sort_criteria) > 0:
-                criterion = sort_criteria[0][0]
-                descending = sort_criteria[0][1] == '-'
-                results = sorted(results, key=lambda r: r[criterion].pvalue, reverse=descending)
+        if len(results) == 1:
+            results = results[0]
 
-            if len(results) == 1:
-                results = results[0]
+        return results, len(redirected) > 0
 
-            caching.set_wikiquery(q, email, results)
-        return results
+    @classmethod
+    def get_data_by_titles(cls, titles, redirected=None):
+        """Returns typed data of given pages from stored snapshots, parsing bodies only for redirects
+        and pages without a snapshot. A snapshot is deleted before its page is saved, so one which
+        exists is of current revision and pages aren't loaded to check it.
+
+        Titles whose data is of their redirect target are added to `redirected` if given."""
+        snapshots = WikiPageData.get_by_titles(titles)
+        usable = [s is not None and s.metadata is not None and u'redirect' not in s.metadata for s in snapshots]
+        fallbacks = [t for t, u in zip(titles, usable) if not u]
+        caching.prefetch_pages(fallbacks, ['data'])
+        fallback_pages = cls.get_by_titles(fallbacks)
+        fallback_data = dict(zip(fallbacks, [p.data for p in fallback_pages]))
+        if redirected is not None:
+            redirected += [t for t, p in zip(fallbacks, fallback_pages) if p.title != t]
+        return [s.data if u else fallback_data[t] for t, s, u in zip(titles, snapshots, usable)]
 
     @classmethod
     def _evaluate_pages(cls, q):
@@ -775,9 +930,23 @@ class WikiPage(ndb.Model, PageOperationMixin):
 
     @classmethod
     def _evaluate_page_query_term(cls, name, value):
+        return SchemaDataIndex.query_titles(*cls._page_query_term(name, value))
+
+    @classmethod
+    def _page_query_terms(cls, q):
+        """Returns (name, value) index terms which results of a page query depend on"""
+        if len(q) == 1:
+            return cls._page_query_terms(q[0])
+        elif len(q) == 2:
+            return {cls._page_query_term(q[0], q[1])}
+        else:
+            return cls._page_query_terms(q[0]) | cls._page_query_terms(q[2:])
+
+    @staticmethod
+    def _page_query_term(name, value):
         if name == 'schema' and value.find('/') == -1:
             value = schema.get_itemtype_path(value)
-        return SchemaDataIndex.query_titles(name, value)
+        return name, SchemaDataIndex.index_value(value)
 
     @classmethod
     def _evaluate_page_query_expr(cls, operand, op, rest):
@@ -785,9 +954,9 @@ class WikiPage(ndb.Model, PageOperationMixin):
         pages2 = cls._evaluate_pages(rest)
 
         if op == '*':
-            return set(pages1).intersection(pages2)
+            return search.intersect_sorted(pages1, pages2)
         elif op == '+':
-            return set(pages1).union(pages2)
+            return search.union_sorted(pages1, pages2)
         raise ValueError('Invalid operator: %s' % op)
 
     @classmethod
@@ -801,16 +970,83 @@ class WikiPage(ndb.Model, PageOperationMixin):
         if title[0] == u'=':
             raise ValueError(u'WikiPage title cannot starts with "="')
 
-        key = cls._key()
-        page = WikiPage.query(WikiPage.title == title, ancestor=key).get()
-        if page is None:
-            page = WikiPage(parent=key, title=title, body=u'', revision=0,
-                            inlinks={}, outlinks={}, related_links={})
-        elif follow_redirect:
+        page = cls._get_pages_by_title_async([title]).get_result()[title]
+        if follow_redirect:
             page = cls._follow_redirect(page)
 
         return page
 
+    @classmethod
+    def get_by_titles(cls, titles, follow_redirect=True):
+        """Returns pages of given titles in the same order, fetching them in batches"""
+        return cls.get_by_titles_async(titles, follow_redirect).get_result()
+
+    @classmethod
+    @ndb.tasklet
+    def get_by_titles_async(cls, titles, follow_redirect=True):
+        titles = list(titles)
+        pages = yield cls._get_pages_by_title_async(titles)
+        result = [pages[title] for title in titles]
+        if follow_redirect:
+            result = yield cls._follow_redirects_async(result)
+        raise ndb.Return(result)
+
+    @classmethod
+    @ndb.tasklet
+    def _get_pages_by_title_async(cls, titles):
+        titles = {title for title in titles if title is not None}
+        if any(title[0] == u'=' for title in titles):
+            raise ValueError(u'WikiPage title cannot starts with "="')
+
+        titles = list(titles)
+        keys = [cls._title_key(title) for title in titles]
+        pages = dict(zip(titles, (yield ndb.get_multi_async(keys))))
+
+        missings = [title for title in titles if pages[title] is None]
+        if missings and not StorageMigration.is_finished(cls.title_key_migration):
+            legacy_pages = yield [WikiPage.query(WikiPage.title == title, ancestor=cls._key()).get_async()
+                                  for title in missings]
+            pages.update(zip(missings, legacy_pages))
+
+        for title in missings:
+            if pages[title] is None:
+                pages[title] = WikiPage(key=cls._title_key(title), title=title, body=u'', revision=0,
+                                        outlinks={}, related_links={})
+
+        pages[None] = None
+        raise ndb.Return(pages)
+
+    @classmethod
+    @ndb.tasklet
+    def _follow_redirects_async(cls, pages):
+        """Resolves redirect chains of all pages level by level, one batch per level"""
+        pages = list(pages)
+        caching.prefetch_pages([page.title for page in pages if page], ['metadata'])
+        trails = [{page.title} if page else set() for page in pages]
+        pending = [i for i, page in enumerate(pages) if page and 'redirect' in page.metadata]
+
+        while pending:
+            next_titles = [pages[i].metadata['redirect'] for i in pending]
+            for i, next_title in zip(pending, next_titles):
+                if next_title in trails[i]:
+                    raise ValueError('Circular redirection detected')
+                trails[i].add(next_title)
+
+            next_pages = yield cls._get_pages_by_title_async(next_titles)
+            caching.prefetch_pages(next_titles, ['metadata'])
+            for i, next_title in zip(pending, next_titles):
+                pages[i] = next_pages[next_title]
+            pending = [i for i in pending if 'redirect' in pages[i].metadata]
+
+        raise ndb.Return(pages)
+
+    @classmethod
+    @ndb.tasklet
+    def _get_link_pages_async(cls, links, follow_redirect=True):
+        titles = list({title for titles in links.values() for title in titles})
+        pages = yield cls.get_by_titles_async(titles, follow_redirect)
+        raise ndb.Return(dict(zip(titles, pages)))
+
     @classmethod
     def _follow_redirect(cls, page, new_redir=None):
         trail = {page.title}
@@ -823,6 +1059,7 @@ class WikiPage(ndb.Model, PageOperationMixin):
 
             if next_title in trail:
                 raise ValueError('Circular redirection detected')
+            trail.add(next_title)
             page = cls.get_by_title(next_title)
         return page
 
@@ -866,8 +1103,77 @@ class WikiPage(ndb.Model, PageOperationMixin):
 
     @classmethod
     def _key(cls):
+        """Ancestor of pages in legacy layout, where the whole wiki was a single entity group"""
         return ndb.Key(u'wiki', u'/')
 
+    @classmethod
+    def _title_key(cls, title):
+        return ndb.Key(WikiPage, title)
+
+    @classmethod
+    def migrate_to_title_keys(cls, cursor=None):
+        """Move pages stored under the legacy entity group to root keys derived from their titles"""
+        logging.debug('Migrating to title keys: %s' % cursor)
+
+        batch_size = 50
+        start_cursor = ndb.Cursor(urlsafe=cursor) if cursor else None
+        legacy_pages, next_cursor, more = cls.query(ancestor=cls._key()).fetch_page(batch_size, start_cursor=start_cursor)
+
+        if legacy_pages:
+            latests = {}
+            for p in legacy_pages:
+                if p.title not in latests or latests[p.title].revision < p.revision:
+                    latests[p.title] = p
+            latests = latests.values()
+
+            existings = ndb.get_multi([cls._title_key(p.title) for p in latests])
+            migrated = [WikiPage(key=cls._title_key(p.title), **p.to_dict())
+                        for p, existing in zip(latests, existings)
+                        if existing is None or existing.revision < p.revision]
+            ndb.put_multi(migrated)
+            ndb.delete_multi([p.key for p in legacy_pages])
+
+        if more and next_cursor:
+            deferred.defer(cls.migrate_to_title_keys, next_cursor.urlsafe())
+        else:
+            StorageMigration.finish(cls.title_key_migration)
+            logging.debug('Migrating to title keys: Finished!')
+
+    @classmethod
+    def migrate_inlinks_to_edges(cls, cursor=None):
+        """Move inlinks stored in json field of each page to WikiLink edges"""
+        logging.debug('Migrating inlinks to edges: %s' % cursor)
+
+        batch_size = 50
+        start_cursor = ndb.Cursor(urlsafe=cursor) if cursor else None
+        pages, next_cursor, more = cls.query().fetch_page(batch_size, start_cursor=start_cursor)
+        cls._migrate_legacy_inlinks_async(pages).get_result()
+
+        if more and next_cursor:
+            deferred.defer(cls.migrate_inlinks_to_edges, next_cursor.urlsafe())
+        else:
+            logging.debug('Migrating inlinks to edges: Finished!')
+
+    @classmethod
+    @ndb.tasklet
+    def _migrate_legacy_inlinks_async(cls, pages):
+        pages = dict((page.title, page) for page in pages if page.legacy_inlinks).values()
+        edges = [WikiLink.create(source, rel, page.title)
+                 for page in pages
+                 for rel, sources in page.legacy_inlinks.items()
+                 for source in sources]
+        for page in pages:
+            page.legacy_inlinks = None
+            page._set_inlinks(None)
+
+        yield ndb.put_multi_async(edges + pages)
+
+    @classmethod
+    def _prefetch_inlinks(cls, pages):
+        futures = [(page, WikiLink.get_inlinks_async(page.title)) for page in pages]
+        for page, future in futures:
+            page._set_inlinks(future.get_result())
+
     @classmethod
     def rebuild_all_data_index(cls, page_index=0):
         logging.debug('Rebuilding data index: %d' % page_index)
@@ -875,10 +1181,15 @@ class WikiPage(ndb.Model, PageOperationMixin):
         batch_size = 20
         all_pages = list(cls.query().fetch(batch_size, offset=page_index * batch_size))
         if len(all_pages) == 0:
+            StorageMigration.finish(SchemaDataIndex.key_migration)
+            StorageMigration.finish(SchemaDataPosting.migration)
             logging.debug('Rebuilding data index: Finished!')
             return
 
-        [SchemaDataIndex.rebuild_index(p.title, p.data) for p in all_pages]
+        for p in all_pages:
+            data = p.data
+            SchemaDataIndex.rebuild_index(p.title, data)
+            WikiPageData.put_unless_superseded(p._build_data_snapshot(data, p.metadata))
         deferred.defer(cls.rebuild_all_data_index, page_index + 1)
 
     @classmethod
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import schema
+from google.appengine.ext import ndb
+
+
+class PackedDataProperty(ndb.PickleProperty):
+    """Typed data pickled in the wire format of schema.pack_data()"""
+    def _to_base_type(self, value):
+        return schema.pack_data(value)
+
+    def _from_base_type(self, value):
+        return schema.unpack_data(value)
+
+
+class WikiPageData(ndb.Model):
+    """Parsed data, metadata, hashbangs and rendered main body of a page, stored once when the page is saved"""
+    revision = ndb.IntegerProperty(indexed=False)
+    data = PackedDataProperty(compressed=True)
+    metadata = ndb.JsonProperty()
+    hashbangs = ndb.JsonProperty()
+    html = ndb.TextProperty(compressed=True)
+
+    @classmethod
+    def key_for(cls, title):
+        return ndb.Key(cls, title)
+
+    @classmethod
+    def get_by_titles(cls, titles):
+        return ndb.get_multi([cls.key_for(title) for title in titles])
+
+    @classmethod
+    @ndb.transactional
+    def put_unless_superseded(cls, snapshot):
+        """Put snapshot unless one of a later revision has been stored meanwhile"""
+        stored = snapshot.key.get()
+        if stored is None or stored.revision <= snapshot.revision:
+            snapshot.put()
+
+    @classmethod
+    def delete_by_title(cls, title):
+        cls.key_for(title).delete()
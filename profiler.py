@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import json
+import logging
+import threading
+import traceback
+from functools import wraps
+from contextlib import contextmanager
+from collections import OrderedDict
+from google.appengine.api import apiproxy_stub_map
+
+
+# API services whose RPCs are timed, and their phase names
+rpc_phases = {
+    'datastore_v3': 'datastore',
+    'memcache': 'memcache',
+}
+
+# a call site doing this many single entity lookups in a request is reported
+repeated_lookup_threshold = 5
+
+# number of innermost application frames which identify a call site
+call_site_depth = 4
+
+_app_root = os.path.dirname(os.path.abspath(__file__))
+_lib_root = os.path.join(_app_root, 'lib')
+
+
+class RequestProfile(threading.local):
+    """Time spent in each phase of current request"""
+    def __init__(self):
+        self.enabled = False
+        self.started_at = None
+        self.phases = OrderedDict()
+        self.rpcs = {}
+
+    def start(self, enabled):
+        self.enabled = enabled
+        self.started_at = time.time()
+        self.phases = OrderedDict()
+        self.rpcs = {}
+
+    def add(self, name, sec):
+        count, total = self.phases.get(name, (0, 0.0))
+        self.phases[name] = (count + 1, total + sec)
+
+
+class RpcAudit(threading.local):
+    """RPCs counted per service, and single entity lookups counted per call site"""
+    def __init__(self):
+        self.enabled = False
+        self.counts = {}
+        self.lookups = {}
+
+    def start(self):
+        self.enabled = True
+        self.counts = {}
+        self.lookups = {}
+
+    def stop(self):
+        self.enabled = False
+
+    def record(self, service, call, request):
+        name = rpc_phases[service]
+        self.counts[name] = self.counts.get(name, 0) + 1
+        if call == 'Get' and request.key_size() == 1:
+            site = (name, _call_site())
+            self.lookups[site] = self.lookups.get(site, 0) + 1
+
+    def repeated_lookups(self, threshold=None):
+        """Returns (service, call site, count) of call sites which did single lookups repeatedly"""
+        if threshold is None:
+            threshold = repeated_lookup_threshold
+        repeated = [(name, site, count) for (name, site), count in self.lookups.items() if count >= threshold]
+        return sorted(repeated, key=lambda r: r[2], reverse=True)
+
+
+profile = RequestProfile()
+audit = RpcAudit()
+
+
+def start(enabled):
+    if enabled:
+        _install_hooks()
+    profile.start(enabled)
+
+
+def is_enabled():
+    return profile.enabled
+
+
+def start_audit():
+    """Start counting RPCs. Returns False if they're already counted by an outer caller"""
+    if audit.enabled:
+        return False
+    _install_hooks()
+    audit.start()
+    return True
+
+
+def stop_audit():
+    audit.stop()
+
+
+def format_lookups(lookups):
+    return [u'%d single %s lookups from\n%s' % (count, name, u'\n'.join(u'  %s:%d in %s' % frame for frame in site))
+            for name, site, count in lookups]
+
+
+@contextmanager
+def phase(name):
+    if not profile.enabled:
+        yield
+        return
+
+    started_at = time.time()
+    try:
+        yield
+    finally:
+        profile.add(name, time.time() - started_at)
+
+
+def timed(name):
+    """Decorator which records time spent in a function as a phase"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def server_timing():
+    """Value of Server-Timing header for phases of current request"""
+    metrics = ['%s;dur=%.1f;desc="%d calls"' % (name, total * 1000, count)
+               for name, (count, total) in profile.phases.items()]
+    metrics.append('total;dur=%.1f' % ((time.time() - profile.started_at) * 1000))
+    return ', '.join(metrics)
+
+
+def log(path):
+    logging.info('profile %s' % json.dumps({
+        'path': path,
+        'total_msec': round((time.time() - profile.started_at) * 1000, 1),
+        'phases': OrderedDict((name, {'count': count, 'msec': round(total * 1000, 1)})
+                              for name, (count, total) in profile.phases.items()),
+    }))
+
+
+def _call_site():
+    frames = [(os.path.relpath(filename, _app_root), lineno, name)
+              for filename, lineno, name, _ in traceback.extract_stack()
+              if _is_app_file(filename)]
+    return tuple(reversed(frames[-call_site_depth:]))
+
+
+def _is_app_file(filename):
+    filename = os.path.abspath(filename)
+    return filename.startswith(_app_root) and not filename.startswith(_lib_root) and \
+        os.path.splitext(filename)[0] != os.path.splitext(os.path.abspath(__file__))[0]
+
+
+def _pre_call_hook(service, call, request, response, rpc=None):
+    if audit.enabled:
+        audit.record(service, call, request)
+    if profile.enabled:
+        profile.rpcs[id(rpc) if rpc is not None else (service, call)] = time.time()
+
+
+def _post_call_hook(service, call, request, response, rpc=None, error=None):
+    if profile.enabled:
+        started_at = profile.rpcs.pop(id(rpc) if rpc is not None else (service, call), None)
+        if started_at is not None:
+            profile.add(rpc_phases[service], time.time() - started_at)
+
+
+def _install_hooks():
+    # Append() ignores hooks already installed on current apiproxy
+    for service in rpc_phases:
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('profiler_%s' % service, _pre_call_hook, service)
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append('profiler_%s' % service, _post_call_hook, service)
@@ -3,6 +3,7 @@ import os
 import re
 import main
 import json
+import profiler
 import jinja2
 from google.appengine.api import users
 from models import WikiPage, UserPreferences, get_cur_user
@@ -98,6 +99,7 @@ JINJA.filters['to_pluspath'] = to_pluspath
 JINJA.filters['userpage'] = userpage_link
 
 
+@profiler.timed('template')
 def template(req, path, data):
     config = WikiPage.get_config()
     user = get_cur_user()
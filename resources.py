@@ -1,6 +1,8 @@
 # coding=utf-8
 import os
 import json
+import main
+import hashlib
 import urllib2
 import search
 import schema
@@ -9,9 +11,10 @@ import operator
 from pyatom import AtomFeed
 from itertools import groupby
 from collections import OrderedDict
-from models.utils import title_grouper
+from webob.datetime_utils import UTC
+from models.utils import title_grouper, is_admin_user
 from models import WikiPage, WikiPageRevision, ConflictError, UserPreferences
-from representations import Representation, EmptyRepresentation, JsonRepresentation, TemplateRepresentation, get_cur_user, format_iso_datetime, template
+from representations import Representation, EmptyRepresentation, JsonRepresentation, TemplateRepresentation, get_cur_user, format_iso_datetime, template, is_mobile
 
 
 class Resource(object):
@@ -130,6 +133,37 @@ class PageLikeResource(Resource):
 
         return 'wikipage.html'
 
+    def _not_modified(self, page, has_fragments=False):
+        """Set validators for the representation of page and check if the client already has it
+
+        Last-Modified is sent only if the representation doesn't include fragments
+        (inlinks, related links, ...). They change without touching updated_at."""
+        if page.updated_at is None:
+            return False
+
+        tag = u'\t'.join([
+            page.title,
+            unicode(page.revision),
+            caching.get_render_version(page.title),
+            caching.get_render_version(u'.config'),
+            self.req.query_string.decode('utf-8'),
+            self.user.email() if self.user else u'',
+            self.req.cookies.get('ecogwiki_redirect_from', u''),
+            unicode(is_mobile(self.req)),
+            main.VERSION,
+        ])
+        etag = hashlib.md5(tag.encode('utf-8')).hexdigest()
+        last_modified = None if has_fragments else page.updated_at.replace(microsecond=0, tzinfo=UTC)
+
+        self.res.etag = etag
+        self.res.last_modified = last_modified
+
+        if 'If-None-Match' in self.req.headers:
+            return etag in self.req.if_none_match
+        if last_modified is not None and self.req.if_modified_since is not None:
+            return last_modified <= self.req.if_modified_since
+        return False
+
     def _403(self, page, head=False):
         self.res.status = 403
         self.res.headers['Content-Type'] = 'text/html; charset=utf-8'
@@ -144,6 +178,8 @@ class PageLikeResource(Resource):
 
 class PageResource(PageLikeResource):
     def load(self):
+        # everything cached for the page, and render version of .config for validators
+        caching.prefetch_pages([WikiPage.path_to_title(self.path), u'.config'])
         return WikiPage.get_by_path(self.path)
 
     def get(self, head):
@@ -162,9 +198,18 @@ class PageResource(PageLikeResource):
                 path = WikiPage.title_to_path(redirect)
                 return RedirectResource(self.req, self.res, path, redirect_from=page.title).get(head)
 
+        if self._not_modified(page, has_fragments=True):
+            self.res.status = 304
+            return
+
         representation = self.get_representation(page)
         representation.respond(self.res, head)
 
+        # a stale body must not be revalidated with validators of the current revision
+        if page.stale_body_served:
+            self.res.etag = None
+            self.res.last_modified = None
+
     def post(self):
         page = self.load()
 
@@ -303,6 +348,8 @@ class RevisionResource(PageLikeResource):
 
         if not page.can_read(self.user):
             self._403(page, head)
+        elif self._not_modified(page):
+            self.res.status = 304
         else:
             representation = self.get_representation(page)
             representation.respond(self.res, head)
@@ -570,6 +617,40 @@ class UserPreferencesResource(Resource):
         }, self.req, 'sp_preferences.html')
 
 
+class CacheStatsResource(Resource):
+    def load(self):
+        return {
+            'names': caching.stats_names,
+            'families': sorted(caching.get_stats().items()),
+            'store_failures': caching.get_store_failures(),
+        }
+
+    def get(self, head):
+        if not is_admin_user(self.user):
+            self.res.status = 403
+            TemplateRepresentation({
+                'page': {
+                    'absolute_url': '/sp.cache_stats',
+                    'title': 'Cache statistics',
+                },
+                'description': 'You don\'t have a permission',
+                'errors': [],
+            }, self.req, 'error.html').respond(self.res, head)
+            return
+        else:
+            representation = self.get_representation(self.load())
+            representation.respond(self.res, head)
+
+    def represent_html_default(self, stats):
+        return TemplateRepresentation(stats, self.req, 'sp_cache_stats.html')
+
+    def represent_json_default(self, stats):
+        return JsonRepresentation({
+            'families': OrderedDict(stats['families']),
+            'store_failures': stats['store_failures'],
+        })
+
+
 class SchemaResource(Resource):
     def __init__(self, req, res, path):
         super(SchemaResource, self).__init__(req, res)
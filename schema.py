@@ -4,7 +4,9 @@ import os
 import re
 import sys
 import json
+import marshal
 import caching
+import hashlib
 import operator
 from datetime import date, datetime
 from markdownext import md_wikilink
@@ -17,160 +19,132 @@ SCHEMA_TO_LOAD = [
 ]
 
 
-def get_schema_set():
-    schema_set = caching.get_schema_set()
-    if schema_set is not None:
-        return schema_set
-
-    for s in SCHEMA_TO_LOAD:
-        if type(s) == dict:
-            new_schema = s
-        else:
-            fullpath = os.path.join(os.path.dirname(__file__), s)
-            try:
-                with open(fullpath) as f:
-                    new_schema = json.load(f)
-            except IOError:
-                new_schema = {}
-
-        schema_set = _merge_schema_set(new_schema, schema_set)
+# schema set compiled ahead of time by compile_schema.py
+COMPILED_SCHEMA = 'schema.compiled'
 
-        if 'ui' not in schema_set:
-            schema_set['ui'] = {'selectableTypes': []}
+_registry = None
 
-    caching.set_schema_set(schema_set)
-    return schema_set
+# ConversionPlan per itemtype, built on first conversion and dropped with registry
+_conversion_plans = {}
 
+# canonical instances of itemtype and datatype names, shared by all Property objects
+_names = {}
 
-def get_legacy_spellings():
-    schema_set = get_schema_set()
-    props = schema_set['properties']
-    return {pname for pname, pdata in props.items() if 'comment' in pdata and pdata['comment'].find('(legacy spelling;') != -1}
 
+class SchemaRegistry(object):
+    """Schema set with defaults, ancestors, inherited properties, cardinalities
+    and itemtype paths resolved once. Everything in it is shared by all
+    requests of an instance, so callers must not modify what they get."""
+    def __init__(self, schema_set):
+        self.schema_set = schema_set
 
-def get_sc_schema(itemtype):
-    schema = get_schema(itemtype).copy()
-
-    # extend properties to include cardinalities and type infos
-    props = collections.OrderedDict()
-    for p in schema['properties']:
-        props[p] = {
-            'cardinality': get_cardinality(itemtype, p),
-            'type': get_property(p)
-        }
-    schema['properties'] = props
-
-    # remove specific properties which are redundent
-    del schema['specific_properties']
-
-    return schema
-
-
-def get_schema(itemtype, self_contained=False):
-    if self_contained:
-        return get_sc_schema(itemtype)
-
-    item = caching.get_schema(itemtype)
-    if item is not None:
-        return item
-
-    item = get_schema_set()['types'][itemtype]
+        props = schema_set['properties']
+        self.legacy_spellings = frozenset(pname for pname, pdata in props.items()
+                                          if 'comment' in pdata and pdata['comment'].find('(legacy spelling;') != -1)
+        self.properties = dict((pname, _compile_property(pname, pdata))
+                               for pname, pdata in props.items() if pname not in self.legacy_spellings)
+        self.datatypes = dict((type_name, _compile_datatype(type_name, dtype))
+                              for type_name, dtype in schema_set['datatypes'].items())
+
+        self.types = {}
+        self.itemtype_paths = {}
+        self.cardinalities = {}
+        for itemtype in schema_set['types']:
+            try:
+                self._compile_type(itemtype)
+                self.itemtype_paths[itemtype] = self._compile_itemtype_path(itemtype)
+                self.cardinalities[itemtype] = dict((pname, self.get_cardinality(itemtype, pname))
+                                                    for pname in self.types[itemtype]['properties'])
+            except KeyError:
+                # types which refer to unknown types or properties stay unresolved
+                pass
 
-    # populate missing fields
-    if 'url' not in item:
-        item['url'] = '/sp.schema/types/%s' % itemtype
-    if 'id' not in item:
-        item['id'] = itemtype
-    if 'label' not in item:
-        item['label'] = item['id']
-    if 'comment' not in item:
-        item['comment'] = item['label']
-    if 'comment_plain' not in item:
-        item['comment_plain'] = item['comment']
-    if 'subtypes' not in item:
-        item['subtypes'] = []
-    if 'ancestors' not in item:
-        # collect ancestors
-        ancestors = []
-        parent = item
-        while len(parent['supertypes']) > 0:
-            parent_itemtype = parent['supertypes'][0]
-            ancestors.append(parent_itemtype)
-            parent = get_schema(parent_itemtype)
-        ancestors.reverse()
-        item['ancestors'] = ancestors
-    if 'plural_label' not in item:
-        if item['label'][-2:] in ['ay', 'ey', 'iy', 'oy', 'uy', 'wy']:
-            item['plural_label'] = u'%ss' % item['label']
-        elif item['label'].endswith('y'):
-            item['plural_label'] = u'%sies' % item['label'][:-1]
-        elif item['label'].endswith('s') or item['label'].endswith('o'):
-            item['plural_label'] = u'%ses' % item['label']
+        labels = dict((k, self.types[k]['label'] if k in self.types else v.get('label', k))
+                      for k, v in schema_set['types'].items())
+        self.itemtypes = sorted(labels.items(), key=operator.itemgetter(0))
+        selectable_itemtypes = schema_set['ui']['selectableTypes']
+        if len(selectable_itemtypes):
+            self.selectable_itemtypes = [(k, labels[k]) for k in selectable_itemtypes]
         else:
-            item['plural_label'] = u'%ss' % item['label']
-
-    # inherit properties of supertypes
-    if 'properties' not in item:
-        item['properties'] = []
-
-    for stype in item['supertypes']:
-        super_props = [p for p in get_schema(stype)['properties'] if p not in item['properties']]
-        item['properties'] += super_props
-
-    # remove legacy spellings
-    legacy_spellings = set(get_legacy_spellings())
-
-    item['properties'] = [p for p in item['properties'] if p not in legacy_spellings]
-    sprops = [p for p in item['specific_properties'] if p not in legacy_spellings]
-
-    # merge specific_properties into properties and sort
-    item['properties'] += [p for p in sprops if p not in item['properties']]
-    item['specific_properties'] = sprops
-
-    caching.set_schema(itemtype, item)
-    return item
-
-
-def get_itemtypes():
-    itemtypes = caching.get_schema_itemtypes()
-    if itemtypes is not None:
-        return itemtypes
-
-    itemtypes = sorted(
-        [(k, v['label']) for k, v in get_schema_set()['types'].items()],
-        key=operator.itemgetter(0)
-    )
-
-    caching.set_schema_itemtypes(itemtypes)
-    return itemtypes
+            self.selectable_itemtypes = self.itemtypes
 
+    def get_cardinality(self, itemtype, prop_name):
+        try:
+            return self.types[itemtype]['cardinalities'][prop_name]
+        except KeyError:
+            prop = get_property(prop_name, self)
+            return prop['cardinality'] if 'cardinality' in prop else [0, 0]
+
+    def _compile_type(self, itemtype):
+        if itemtype in self.types:
+            return self.types[itemtype]
+
+        item = dict(self.schema_set['types'][itemtype])
+
+        # populate missing fields
+        if 'url' not in item:
+            item['url'] = '/sp.schema/types/%s' % itemtype
+        if 'id' not in item:
+            item['id'] = itemtype
+        if 'label' not in item:
+            item['label'] = item['id']
+        if 'comment' not in item:
+            item['comment'] = item['label']
+        if 'comment_plain' not in item:
+            item['comment_plain'] = item['comment']
+        if 'subtypes' not in item:
+            item['subtypes'] = []
+        if 'ancestors' not in item:
+            # collect ancestors
+            ancestors = []
+            parent = item
+            while len(parent['supertypes']) > 0:
+                parent_itemtype = parent['supertypes'][0]
+                ancestors.append(parent_itemtype)
+                parent = self._compile_type(parent_itemtype)
+            ancestors.reverse()
+            item['ancestors'] = ancestors
+        if 'plural_label' not in item:
+            if item['label'][-2:] in ['ay', 'ey', 'iy', 'oy', 'uy', 'wy']:
+                item['plural_label'] = u'%ss' % item['label']
+            elif item['label'].endswith('y'):
+                item['plural_label'] = u'%sies' % item['label'][:-1]
+            elif item['label'].endswith('s') or item['label'].endswith('o'):
+                item['plural_label'] = u'%ses' % item['label']
+            else:
+                item['plural_label'] = u'%ss' % item['label']
 
-def get_selectable_itemtypes():
-    itemtypes = caching.get_schema_selectable_itemtypes()
-    if itemtypes is not None:
-        return itemtypes
+        # inherit properties of supertypes
+        properties = list(item.get('properties', []))
+        for stype in item['supertypes']:
+            properties += [p for p in self._compile_type(stype)['properties'] if p not in properties]
 
-    all_itemtypes = get_schema_set()['types']
-    selectable_itemtypes = get_schema_set()['ui']['selectableTypes']
+        # remove legacy spellings
+        properties = [p for p in properties if p not in self.legacy_spellings]
+        sprops = [p for p in item['specific_properties'] if p not in self.legacy_spellings]
 
-    if len(selectable_itemtypes):
-        itemtypes = [(k, all_itemtypes[k]['label']) for k in selectable_itemtypes]
-    else:
-        itemtypes = sorted(
-            [(k, v['label']) for k, v in all_itemtypes.items()],
-            key=operator.itemgetter(0)
-        )
+        # merge specific_properties into properties
+        properties += [p for p in sprops if p not in properties]
+        item['properties'] = properties
+        item['specific_properties'] = sprops
 
-    caching.set_schema_selectable_itemtypes(itemtypes)
-    return itemtypes
+        self.types[itemtype] = item
+        return item
 
+    def _compile_itemtype_path(self, itemtype):
+        parts = []
+        parent = itemtype
+        while parent is not None:
+            parts.append(parent)
+            supers = self.types[parent]['supertypes']
+            parent = supers[0] if len(supers) > 0 else None
+        parts.reverse()
+        parts.append('')
+        return '/'.join(parts)
 
-def get_datatype(type_name):
-    dtype = caching.get_schema_datatype(type_name)
-    if dtype is not None:
-        return dtype
 
-    dtype = get_schema_set()['datatypes'][type_name]
+def _compile_datatype(type_name, dtype):
+    dtype = dict(dtype)
 
     # populate missing fields
     if 'url' not in dtype:
@@ -193,20 +167,11 @@ def get_datatype(type_name):
         dtype['comment_plain'] = dtype['comment']
     if 'ancestors' not in dtype:
         dtype['ancestors'] = dtype['supertypes']
-
-    caching.set_schema_datatype(type_name, dtype)
     return dtype
 
 
-def get_property(prop_name):
-    if prop_name in get_legacy_spellings():
-        raise KeyError('Legacy spelling: %s' % prop_name)
-
-    prop = caching.get_schema_property(prop_name)
-    if prop is not None:
-        return prop
-
-    prop = get_schema_set()['properties'][prop_name]
+def _compile_property(prop_name, prop):
+    prop = dict(prop)
 
     # populate missing fields
     if 'domains' not in prop:
@@ -223,30 +188,149 @@ def get_property(prop_name):
         prop['comment_plain'] = prop['comment']
     if 'reversed_label' not in prop:
         prop['reversed_label'] = '[%%s] %s' % prop['label']
-
-    caching.set_schema_property(prop_name, prop)
     return prop
 
 
-def get_cardinality(itemtype, prop_name):
+def get_registry():
+    global _registry
+    if _registry is None:
+        _registry = _load_registry()
+    return _registry
+
+
+def clear_registry():
+    global _registry
+    _registry = None
+    _conversion_plans.clear()
+
+
+caching.on_flush_all(clear_registry)
+
+
+def write_compiled_schema():
+    """Compile schema files into COMPILED_SCHEMA, which is loaded instead of them while they stay the same"""
+    registry = SchemaRegistry(_load_schema_set())
+    with open(os.path.join(os.path.dirname(__file__), COMPILED_SCHEMA), 'wb') as f:
+        marshal.dump(_schema_signature(), f)
+        marshal.dump(registry.__dict__, f)
+
+
+def _load_registry():
+    # marshal loads plain dicts and lists about twice as fast as parsing and compiling schema files
+    try:
+        with open(os.path.join(os.path.dirname(__file__), COMPILED_SCHEMA), 'rb') as f:
+            if marshal.load(f) == _schema_signature():
+                registry = SchemaRegistry.__new__(SchemaRegistry)
+                registry.__dict__.update(marshal.load(f))
+                return registry
+    except (IOError, EOFError, ValueError, TypeError):
+        pass
+    return SchemaRegistry(_load_schema_set())
+
+
+def _schema_signature():
+    """Digest of schema sources, which is much cheaper than parsing them"""
+    digest = hashlib.md5()
+    for s in SCHEMA_TO_LOAD:
+        if type(s) == dict:
+            digest.update(json.dumps(s, sort_keys=True))
+        else:
+            try:
+                with open(os.path.join(os.path.dirname(__file__), s), 'rb') as f:
+                    digest.update(f.read())
+            except IOError:
+                pass
+        digest.update('\0')
+    return digest.hexdigest()
+
+
+def _load_schema_set():
+    schema_set = None
+    for s in SCHEMA_TO_LOAD:
+        if type(s) == dict:
+            new_schema = s
+        else:
+            fullpath = os.path.join(os.path.dirname(__file__), s)
+            try:
+                with open(fullpath) as f:
+                    new_schema = json.load(f)
+            except IOError:
+                new_schema = {}
+
+        schema_set = _merge_schema_set(new_schema, schema_set)
+
+        if 'ui' not in schema_set:
+            schema_set['ui'] = {'selectableTypes': []}
+    return schema_set
+
+
+def get_schema_set():
+    return get_registry().schema_set
+
+
+def get_legacy_spellings():
+    return get_registry().legacy_spellings
+
+
+def get_sc_schema(itemtype):
+    schema = get_schema(itemtype).copy()
+
+    # extend properties to include cardinalities and type infos
+    props = collections.OrderedDict()
+    for p in schema['properties']:
+        props[p] = {
+            'cardinality': get_cardinality(itemtype, p),
+            'type': get_property(p)
+        }
+    schema['properties'] = props
+
+    # remove specific properties which are redundent
+    del schema['specific_properties']
+
+    return schema
+
+
+def get_schema(itemtype, self_contained=False):
+    if self_contained:
+        return get_sc_schema(itemtype)
+    return get_registry().types[itemtype]
+
+
+def get_itemtypes():
+    return get_registry().itemtypes
+
+
+def get_selectable_itemtypes():
+    return get_registry().selectable_itemtypes
+
+
+def get_datatype(type_name):
+    return get_registry().datatypes[type_name]
+
+
+def get_property(prop_name, registry=None):
+    if registry is None:
+        registry = get_registry()
+    # legacy spellings are left out of the table, so a hit needs just one lookup
     try:
-        item = get_schema(itemtype)
-        return item['cardinalities'][prop_name]
+        return registry.properties[prop_name]
     except KeyError:
-        prop = get_property(prop_name)
-        return prop['cardinality'] if 'cardinality' in prop else [0, 0]
+        if prop_name in registry.legacy_spellings:
+            raise KeyError('Legacy spelling: %s' % prop_name)
+        raise
+
+
+def get_cardinality(itemtype, prop_name):
+    return get_registry().get_cardinality(itemtype, prop_name)
 
 
 def get_cardinalities(itemtype):
-    result = caching.get_cardinalities(itemtype)
-    if result is not None:
-        return result
+    registry = get_registry()
+    if itemtype in registry.cardinalities:
+        return registry.cardinalities[itemtype]
 
     properties = get_schema(itemtype)['properties']
-    properties_dict = dict([(pname, get_cardinality(itemtype, pname)) for pname in properties])
-
-    caching.set_cardinalities(itemtype, properties_dict)
-    return properties_dict
+    return dict([(pname, get_cardinality(itemtype, pname)) for pname in properties])
 
 
 def humane_item(itemtype, plural=False):
@@ -273,15 +357,7 @@ def humane_property(itemtype, prop, rev=False):
 
 def get_itemtype_path(itemtype):
     try:
-        parts = []
-        parent = itemtype
-        while parent is not None:
-            parts.append(parent)
-            supers = get_schema(parent)['supertypes']
-            parent = supers[0] if len(supers) > 0 else None
-        parts.reverse()
-        parts.append('')
-        return '/'.join(parts)
+        return get_registry().itemtype_paths[itemtype]
     except KeyError:
         raise ValueError('Unsupported schema: %s' % itemtype)
 
@@ -358,6 +434,62 @@ def render_list(o):
     )
 
 
+class ConversionPlan(object):
+    """Known properties and cardinality bounds of an itemtype, and converter
+    chain of each property which is built on first use"""
+    def __init__(self, itemtype):
+        registry = get_registry()
+        self.itemtype = itemtype
+        self.known_props = frozenset(registry.types[itemtype]['properties'] +
+                                     registry.types[itemtype]['specific_properties'] + ['schema'])
+        # [0, 0] is unbounded, which needs no check
+        self.bounds = [(pname, cfrom, cto) for pname, (cfrom, cto) in get_cardinalities(itemtype).items()
+                       if cfrom != 0 or cto != 0]
+        self.converters = {}
+
+    def get_converters(self, pname):
+        """Returns (enum, [(type_obj, ptype, sniff), ...]) with converters ordered by PRIORITY"""
+        try:
+            return self.converters[pname]
+        except KeyError:
+            pass
+
+        prop = get_property(pname)
+        types = [(SchemaConverter.type_by_name(ptype), ptype) for ptype in prop['ranges']]
+        types = sorted(types, key=lambda t: PRIORITY[t[0]])
+        converters = (prop.get('enum'), [(type_obj, ptype, type_obj.SNIFF) for type_obj, ptype in types])
+        self.converters[pname] = converters
+        return converters
+
+    def convert(self, pname, pvalue):
+        if pname == 'schema':
+            return TextProperty(self.itemtype, 'Text', pname, pvalue)
+
+        enum, converters = self.get_converters(pname)
+        if enum is not None and pvalue not in enum:
+            return InvalidProperty(self.itemtype, 'Invalid', pname, pvalue)
+
+        # skip converters which would reject a text without raising and catching ValueError
+        is_text = isinstance(pvalue, basestring)
+        for type_obj, ptype, sniff in converters:
+            if is_text and sniff is not None and sniff.match(pvalue) is None:
+                continue
+            try:
+                return type_obj(self.itemtype, ptype, pname, pvalue)
+            except ValueError:
+                pass
+        return InvalidProperty(self.itemtype, 'Invalid', pname, pvalue)
+
+
+def get_conversion_plan(itemtype):
+    try:
+        return _conversion_plans[itemtype]
+    except KeyError:
+        plan = ConversionPlan(itemtype)
+        _conversion_plans[itemtype] = plan
+        return plan
+
+
 class SchemaConverter(object):
     def __init__(self, itemtype, data):
         self._itemtype = itemtype
@@ -365,24 +497,25 @@ class SchemaConverter(object):
 
     def convert_schema(self):
         try:
-            schema_item = get_schema(self._itemtype)
+            plan = get_conversion_plan(self._itemtype)
         except KeyError:
             raise ValueError('Unknown itemtype: %s' % self._itemtype)
 
         props = set(self._data.keys())
-        unknown_props = props.difference(schema_item['properties'] + schema_item['specific_properties'] + ['schema'])
+        unknown_props = props.difference(plan.known_props)
         known_props = props.difference(unknown_props)
 
-        self.check_cardinality()
+        self.check_cardinality(plan)
 
-        knowns = [(p, SchemaConverter.convert_prop(self._itemtype, p, self._data[p])) for p in known_props]
+        knowns = [(p, SchemaConverter.convert_prop(self._itemtype, p, self._data[p], plan)) for p in known_props]
         unknowns = [(p, InvalidProperty(self._itemtype, p, p, self._data[p])) for p in unknown_props]
         return dict(knowns + unknowns)
 
-    def check_cardinality(self):
-        cardinalities = get_cardinalities(self._itemtype)
+    def check_cardinality(self, plan=None):
+        if plan is None:
+            plan = get_conversion_plan(self._itemtype)
 
-        for pname, (cfrom, cto) in cardinalities.items():
+        for pname, cfrom, cto in plan.bounds:
             if pname not in self._data:
                 num = 0
             elif type(self._data[pname]) == list:
@@ -398,11 +531,13 @@ class SchemaConverter(object):
                 self._data[pname] = self._data[pname][:cto]
 
     @classmethod
-    def convert_prop(cls, itemtype, pname, pvalue):
+    def convert_prop(cls, itemtype, pname, pvalue, plan=None):
+        if plan is None:
+            plan = get_conversion_plan(itemtype)
         if type(pvalue) is list:
-            return [cls._convert_prop(itemtype, pname, pv) for pv in pvalue]
+            return [plan.convert(pname, pv) for pv in pvalue]
         else:
-            return cls._convert_prop(itemtype, pname, pvalue)
+            return plan.convert(pname, pvalue)
 
     @staticmethod
     def convert(itemtype, data):
@@ -410,24 +545,7 @@ class SchemaConverter(object):
 
     @staticmethod
     def _convert_prop(itemtype, pname, pvalue):
-        if pname == 'schema':
-            return TextProperty(itemtype, 'Text', pname, pvalue)
-
-        prop = get_property(pname)
-        if 'enum' in prop and pvalue not in prop['enum']:
-            return InvalidProperty(itemtype, 'Invalid', pname, pvalue)
-
-        ranges = prop['ranges']
-        types = [(SchemaConverter.type_by_name(ptype), ptype) for ptype in ranges]
-        types = [(type_obj, ptype, PRIORITY[type_obj]) for type_obj, ptype in types]
-        sorted_types = sorted(types, key=operator.itemgetter(2))
-
-        for type_obj, ptype, _ in sorted_types:
-            try:
-                return type_obj(itemtype, ptype, pname, pvalue)
-            except ValueError:
-                pass
-        return InvalidProperty(itemtype, 'Invalid', pname, pvalue)
+        return get_conversion_plan(itemtype).convert(pname, pvalue)
 
     @staticmethod
     def type_by_name(name):
@@ -438,15 +556,29 @@ class SchemaConverter(object):
 
 
 class Property(object):
+    __slots__ = ('itemtype', 'ptype', 'pname', 'pvalue')
+
+    # pattern which a text value must match to be converted, checked before
+    # trying the constructor. it may accept more than constructor does.
+    SNIFF = None
+
     def __init__(self, itemtype, ptype, pname, pvalue):
-        self.itemtype = itemtype
+        self.itemtype = _intern(itemtype)
         self.pname = pname
-        self.ptype = ptype
+        self.ptype = _intern(ptype)
         self.pvalue = pvalue
 
     def __eq__(self, o):
         return type(o) == type(self) and o.pname == self.pname and o.pvalue == self.pvalue
 
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in _slots_of(type(self)) if hasattr(self, name))
+
+    def __setstate__(self, state):
+        # also restores objects pickled with __dict__, before Property had __slots__
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def is_wikilink(self):
         return False
 
@@ -458,6 +590,8 @@ class Property(object):
 
 
 class InvalidProperty(Property):
+    __slots__ = ()
+
     def __eq__(self, other):
         return False
 
@@ -469,6 +603,8 @@ class InvalidProperty(Property):
 
 
 class ThingProperty(Property):
+    __slots__ = ('value',)
+
     def __init__(self, itemtype, ptype, pname, pvalue):
         super(ThingProperty, self).__init__(itemtype, ptype, pname, pvalue)
         try:
@@ -488,6 +624,8 @@ class ThingProperty(Property):
 
 
 class TypeProperty(Property):
+    __slots__ = ()
+
     def __init__(self, itemtype, ptype, pname, pvalue):
         super(TypeProperty, self).__init__(itemtype, ptype, pname, pvalue)
         if ptype not in get_schema_set()['datatypes']:
@@ -495,6 +633,9 @@ class TypeProperty(Property):
 
 
 class BooleanProperty(TypeProperty):
+    __slots__ = ('value',)
+    SNIFF = re.compile(ur'(1|yes|true|0|no|false)\Z', re.I)
+
     def __init__(self, itemtype, ptype, pname, pvalue):
         super(BooleanProperty, self).__init__(itemtype, ptype, pname, pvalue)
         if type(pvalue) == str or type(pvalue) == unicode:
@@ -512,6 +653,8 @@ class BooleanProperty(TypeProperty):
 
 
 class TextProperty(TypeProperty):
+    __slots__ = ('value',)
+
     def __init__(self, itemtype, ptype, pname, pvalue):
         super(TextProperty, self).__init__(itemtype, ptype, pname, pvalue)
         self.value = pvalue
@@ -527,6 +670,8 @@ class TextProperty(TypeProperty):
 
 
 class LongTextProperty(TextProperty):
+    __slots__ = ()
+
     def __init__(self, itemtype, ptype, pname, pvalue):
         super(LongTextProperty, self).__init__(itemtype, ptype, pname, pvalue)
         self.value = pvalue
@@ -542,6 +687,9 @@ class LongTextProperty(TextProperty):
 
 
 class NumberProperty(TypeProperty):
+    __slots__ = ('value',)
+    SNIFF = re.compile(ur'\s*[-+]?(\d|\.\d|inf|nan)', re.I | re.U)
+
     def __init__(self, itemtype, ptype, pname, pvalue):
         super(NumberProperty, self).__init__(itemtype, ptype, pname, pvalue)
         if type(pvalue) == str or type(pvalue) == unicode:
@@ -557,6 +705,8 @@ class NumberProperty(TypeProperty):
 
 
 class IntegerProperty(NumberProperty):
+    __slots__ = ()
+
     def __init__(self, itemtype, ptype, pname, pvalue):
         super(IntegerProperty, self).__init__(itemtype, ptype, pname, pvalue)
 
@@ -573,6 +723,8 @@ class IntegerProperty(NumberProperty):
 
 
 class FloatProperty(NumberProperty):
+    __slots__ = ()
+
     def __init__(self, itemtype, ptype, pname, pvalue):
         super(FloatProperty, self).__init__(itemtype, ptype, pname, pvalue)
 
@@ -586,6 +738,8 @@ class FloatProperty(NumberProperty):
 
 
 class DateTimeProperty(TypeProperty):
+    __slots__ = ()
+
     def __init__(self, itemtype, ptype, pname, pvalue):
         super(TypeProperty, self).__init__(itemtype, ptype, pname, pvalue)
         if isinstance(pvalue, datetime):
@@ -600,11 +754,13 @@ class DateTimeProperty(TypeProperty):
 
 class TimeProperty(TextProperty):
     # TODO implement this (shouldn't inherit from TextProperty)
-    pass
+    __slots__ = ()
 
 
 class URLProperty(TypeProperty):
+    __slots__ = ('value',)
     P_URL = ur'\w+://[a-zA-Z0-9\~\!\@\#\$\%\^\&\*\-\_\=\+\[\]\\\:\;\"\'\,\.\'\?/]+'
+    SNIFF = re.compile(P_URL)
 
     def __init__(self, itemtype, ptype, pname, pvalue):
         super(URLProperty, self).__init__(itemtype, ptype, pname, pvalue)
@@ -618,12 +774,16 @@ class URLProperty(TypeProperty):
 
 
 class EmbeddableURLProperty(URLProperty):
+    __slots__ = ()
+
     def render(self):
         return u'<img src="%s" class="embeddableUrl" itemprop="url">' % self.value
 
 
 class DateProperty(TypeProperty):
+    __slots__ = ('year', 'month', 'day', 'bce')
     P_DATE = ur'(?P<y>\d+)(-(?P<m>(\d\d|\?\?))-(?P<d>(\d\d|\?\?)))?( (?P<bce>BCE))?'
+    SNIFF = re.compile(P_DATE)
 
     def __init__(self, itemtype, ptype, pname, pvalue):
         super(DateProperty, self).__init__(itemtype, ptype, pname, pvalue)
@@ -664,7 +824,9 @@ class DateProperty(TypeProperty):
 
 
 class ISBNProperty(TypeProperty):
+    __slots__ = ('value',)
     P_ISBN = ur'[\dxX]{10,13}'
+    SNIFF = re.compile(P_ISBN)
 
     def __init__(self, itemtype, ptype, pname, pvalue):
         super(ISBNProperty, self).__init__(itemtype, ptype, pname, pvalue)
@@ -709,3 +871,107 @@ PRIORITY = {
 
     Property: 8,
 }
+
+
+# Property classes by wire code. Codes are persisted in data snapshots, so only append to it.
+WIRE_TYPES = [
+    Property, InvalidProperty, ThingProperty, TypeProperty, BooleanProperty,
+    TextProperty, LongTextProperty, NumberProperty, IntegerProperty, FloatProperty,
+    DateTimeProperty, TimeProperty, URLProperty, EmbeddableURLProperty, DateProperty,
+    ISBNProperty,
+]
+
+_slots = {}
+
+
+def _slots_of(type_obj):
+    """All slots of a Property class. The ones of Property come first"""
+    try:
+        return _slots[type_obj]
+    except KeyError:
+        names = []
+        for cls in reversed(type_obj.__mro__):
+            names += cls.__dict__.get('__slots__', ())
+        _slots[type_obj] = names = tuple(names)
+        return names
+
+
+_wire_codes = dict((type_obj, code) for code, type_obj in enumerate(WIRE_TYPES))
+
+# slots of each wire type other than the ones of Property, which follow pvalue in wire format
+_wire_extras = [_slots_of(type_obj)[4:] for type_obj in WIRE_TYPES]
+
+
+def pack_data(data):
+    """Converts typed data of a page into (itemtype, ((pname, value), ...)) of
+    plain tuples, which pickles into a fraction of Property objects. Each
+    Property becomes (code, itemtype, ptype, pvalue, other slots...) where
+    itemtype is None if it's the same as the one of data."""
+    itemtype = None
+    for value in data.itervalues():
+        if type(value) is list:
+            value = value[0] if len(value) > 0 else None
+        if isinstance(value, Property):
+            itemtype = value.itemtype
+            break
+
+    return itemtype, tuple((pname, _pack_value(value, itemtype)) for pname, value in data.iteritems())
+
+
+def unpack_data(packed):
+    """Converts result of pack_data() back into typed data. Data stored before
+    pack_data() existed is a dict, which is returned as it is."""
+    if type(packed) is dict:
+        return packed
+
+    itemtype, items = packed
+    itemtype = _intern(itemtype)
+    data = {}
+    for pname, value in items:
+        if type(value) is list:
+            data[pname] = [_unpack_value(v, itemtype, pname) for v in value]
+        else:
+            data[pname] = _unpack_value(value, itemtype, pname)
+    return data
+
+
+def _pack_value(value, itemtype):
+    if type(value) is list:
+        return [_pack_value(v, itemtype) for v in value]
+    elif isinstance(value, Property):
+        type_obj = type(value)
+        code = _wire_codes[type_obj]
+        return (code, value.itemtype if value.itemtype != itemtype else None,
+                value.ptype, value.pvalue) + tuple(getattr(value, name) for name in _wire_extras[code])
+    else:
+        return value
+
+
+def _unpack_value(value, itemtype, pname):
+    if type(value) is not tuple:
+        return value
+
+    code = value[0]
+    type_obj = WIRE_TYPES[code]
+    prop = type_obj.__new__(type_obj)
+    prop.itemtype = itemtype if value[1] is None else _intern(value[1])
+    prop.ptype = _names.get(value[2], value[2])
+    prop.pname = pname
+    prop.pvalue = value[3]
+    extras = _wire_extras[code]
+    if len(extras) == 1:
+        setattr(prop, extras[0], value[4])
+    elif len(extras) > 1:
+        for name, v in zip(extras, value[4:]):
+            setattr(prop, name, v)
+    return prop
+
+
+def _intern(name):
+    try:
+        return _names[name]
+    except KeyError:
+        # invalid properties take their names from page bodies, so the table is capped
+        if len(_names) < 4096:
+            _names[name] = name
+        return name
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import re
+import bisect
 import operator
 import pyparsing as p
 from collections import OrderedDict
@@ -53,6 +54,41 @@ def _update_scoretable(keys, length, matches, scoretable, sign):
             scoretable[title] += sign * score / length
 
 
+def intersect_sorted(list1, list2):
+    """merge-intersect two sorted lists"""
+    if len(list1) > len(list2):
+        list1, list2 = list2, list1
+
+    result = []
+    lo = 0
+    for item in list1:
+        lo = bisect.bisect_left(list2, item, lo)
+        if lo == len(list2):
+            break
+        if list2[lo] == item:
+            result.append(item)
+            lo += 1
+    return result
+
+
+def union_sorted(list1, list2):
+    """merge two sorted lists removing duplicates"""
+    result = []
+    i, j = 0, 0
+    while i < len(list1) and j < len(list2):
+        if list1[i] < list2[j]:
+            result.append(list1[i])
+            i += 1
+        elif list2[j] < list1[i]:
+            result.append(list2[j])
+            j += 1
+        else:
+            result.append(list1[i])
+            i += 1
+            j += 1
+    return result + list1[i:] + list2[j:]
+
+
 # Wikiquery grammar
 identifier = p.Regex(r'([a-zA-Z_][.0-9a-zA-Z_]*)')
 double_quote_str = p.dblQuotedString.setParseAction(p.removeQuotes)
@@ -2,18 +2,23 @@
 import os
 import random
 import caching
+import profiler
 import unittest2 as unittest
+from contextlib import contextmanager
 from google.appengine.ext import testbed
 from models import get_cur_user, is_admin_user, WikiPage
 
 
 class AppEngineTestCase(unittest.TestCase):
+    # datastore consistency policy. default one applies all writes immediately
+    consistency_policy = None
+
     def setUp(self):
         caching.create_prc()
 
         self.testbed = testbed.Testbed()
         self.testbed.activate()
-        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_datastore_v3_stub(consistency_policy=self.consistency_policy)
         self.testbed.init_memcache_stub()
         self.testbed.init_taskqueue_stub()
         self.testbed.init_user_stub()
@@ -44,3 +49,22 @@ class AppEngineTestCase(unittest.TestCase):
         page = WikiPage.get_by_title(title)
         page.update_content(content, page.revision, user=self.get_cur_user(), dont_defer=True)
         return page
+
+    @contextmanager
+    def assertRpcBudget(self, datastore=None, memcache=None, repeated_lookups=None):
+        """Fail if code in the block makes more RPCs than given, or looks up entities one by one from a call site"""
+        started = profiler.start_audit()
+        try:
+            yield
+        finally:
+            if started:
+                profiler.stop_audit()
+
+        for name, budget in [('datastore', datastore), ('memcache', memcache)]:
+            count = profiler.audit.counts.get(name, 0)
+            if budget is not None and count > budget:
+                self.fail('%d %s RPCs exceeded the budget of %d' % (count, name, budget))
+
+        repeated = profiler.audit.repeated_lookups(repeated_lookups)
+        if repeated:
+            self.fail('\n'.join(profiler.format_lookups(repeated)))
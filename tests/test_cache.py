@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
-from models import WikiPage
+import os
+import caching
+from models import WikiPage, WikiPageData
 from tests import AppEngineTestCase
 from google.appengine.api import memcache
 
@@ -35,7 +37,8 @@ class WikiPageUpdateTest(AppEngineTestCase):
         self.assertIsNotNone(memcache.get(u'model\trendered_body\tHello'))
 
     def test_titles_cache(self):
-        cache_key = u'model\ttitles\tNone'
+        version = caching.get_titles_version()
+        cache_key = u'model\ttitles\t%s' % version
         self.assertIsNone(memcache.get(cache_key))
 
         # populate cache
@@ -45,13 +48,235 @@ class WikiPageUpdateTest(AppEngineTestCase):
         # invalidate cache by adding new page
         page = WikiPage.get_by_title(u'Hello')
         page.update_content(u'Hello', 0, user=self.get_cur_user())
-        self.assertEqual(None, memcache.get(cache_key))
+        self.assertNotEqual(version, caching.get_titles_version())
 
         # populate cache again
+        version = caching.get_titles_version()
         WikiPage.get_titles()
-        self.assertIsNotNone(memcache.get(cache_key))
+        self.assertIsNotNone(memcache.get(u'model\ttitles\t%s' % version))
 
         # Should not be invalidated because it's just an update
         page = WikiPage.get_by_title(u'Hello')
         page.update_content(u'Hello 2', 1, user=self.get_cur_user())
-        self.assertIsNotNone(memcache.get(cache_key))
+        self.assertEqual(version, caching.get_titles_version())
+
+    def test_title_catalog_should_be_filtered_per_user(self):
+        WikiPage.get_by_title(u'Public').update_content(u'Hello', 0, user=self.get_cur_user())
+        WikiPage.get_by_title(u'Private').update_content(u'.read ak@gmail.com\nHello', 0, user=self.get_cur_user())
+
+        self.assertEqual({u'Public', u'Private'}, WikiPage.get_titles(self.get_cur_user()))
+        self.assertEqual({u'Public'}, WikiPage.get_titles(None))
+
+        # changing acl of an existing page invalidates the catalog
+        WikiPage.get_by_title(u'Private').update_content(u'Hello', 1, user=self.get_cur_user())
+        self.assertEqual({u'Public', u'Private'}, WikiPage.get_titles(None))
+
+
+class RenderedFragmentTest(AppEngineTestCase):
+    def setUp(self):
+        super(RenderedFragmentTest, self).setUp()
+        self.login('ak@gmail.com', 'ak')
+
+    def test_main_body_should_be_stored(self):
+        self.update_page(u'Hello', u'A')
+        self.assertEqual(u'<p>Hello</p>', WikiPageData.key_for(u'A').get().html)
+
+    def test_rendered_body_should_include_fragments(self):
+        self.update_page(u'Hello', u'A')
+        self.update_page(u'[[A]]', u'B')
+
+        rendered = WikiPage.get_by_title(u'A').rendered_body
+        self.assertTrue(rendered.startswith(u'<p>Hello</p>\n'))
+        self.assertNotEqual(-1, rendered.find(u'Incoming Links'))
+
+    def test_adding_inlink_should_invalidate_inlinks_fragment_only(self):
+        self.update_page(u'Hello', u'A')
+        _ = WikiPage.get_by_title(u'A').rendered_body
+        self.assertIsNotNone(memcache.get(u'model\trendered_fragment\tinlinks\tA'))
+        self.assertIsNotNone(memcache.get(u'model\trendered_fragment\tother_posts\tA'))
+
+        self.update_page(u'[[A]]', u'B')
+        self.assertIsNone(memcache.get(u'model\trendered_body\tA'))
+        self.assertIsNone(memcache.get(u'model\trendered_fragment\tinlinks\tA'))
+        self.assertIsNotNone(memcache.get(u'model\trendered_fragment\tother_posts\tA'))
+
+
+class LocalCacheTest(AppEngineTestCase):
+    def test_should_be_served_from_process_memory(self):
+        caching.set_config({'a': 1})
+        memcache.delete('model\tconfig')
+        caching.create_prc()
+
+        self.assertEqual({'a': 1}, caching.get_config())
+
+    def test_generation_change_should_invalidate_local_entries(self):
+        caching.set_config({'a': 1})
+
+        # another instance updates config
+        memcache.set('model\tconfig', {'a': 2})
+        memcache.set('generation\tconfig', 'new generation')
+        caching.create_prc()
+
+        self.assertEqual({'a': 2}, caching.get_config())
+
+    def test_delete_should_invalidate_local_entries(self):
+        caching.set_config({'a': 1})
+        caching.del_config()
+        caching.create_prc()
+
+        self.assertIsNone(caching.get_config())
+
+    def test_lru(self):
+        cache = caching.LocalCache(max_size=2)
+        cache.set('a', 1, 'g')
+        cache.set('b', 2, 'g')
+        cache.get('a', 'g')
+        cache.set('c', 3, 'g')
+
+        self.assertEqual(1, cache.get('a', 'g'))
+        self.assertIsNone(cache.get('b', 'g'))
+        self.assertIsNone(cache.get('a', 'other generation'))
+
+    def test_expiration(self):
+        cache = caching.LocalCache(ttl_sec=-1)
+        cache.set('a', 1, 'g')
+        self.assertIsNone(cache.get('a', 'g'))
+
+
+class PrefetchTest(AppEngineTestCase):
+    def test_prefetch_pages(self):
+        caching.set_metadata(u'A', {'schema': 'Book'})
+        caching.set_data(u'B', {'name': u'B'})
+        caching.create_prc()
+
+        caching.prefetch_pages([u'A', u'B'])
+        memcache.delete_multi([u'model\tmetadata\tA', u'model\tdata\tB'])
+
+        self.assertEqual({'schema': 'Book'}, caching.get_metadata(u'A'))
+        self.assertEqual({'name': u'B'}, caching.get_data(u'B'))
+
+    def test_prefetched_misses_should_not_be_fetched_again(self):
+        caching.prefetch_pages([u'A'])
+        memcache.set(u'model\tmetadata\tA', {'schema': 'Book'})
+
+        self.assertIsNone(caching.get_metadata(u'A'))
+
+    def test_del_pages(self):
+        caching.set_metadata(u'A', {'schema': 'Book'})
+        caching.set_data(u'A', {'name': u'A'})
+        caching.del_pages([u'A'])
+
+        self.assertIsNone(memcache.get(u'model\tmetadata\tA'))
+        self.assertIsNone(memcache.get(u'model\tdata\tA'))
+
+
+class LeaseTest(AppEngineTestCase):
+    def setUp(self):
+        super(LeaseTest, self).setUp()
+        self.fills = []
+
+    def fill(self):
+        self.fills.append(1)
+        return u'new'
+
+    def test_first_misser_should_fill_and_keep_shadow(self):
+        self.assertEqual((u'new', False), caching.fill_rendered_body(u'A', self.fill))
+        self.assertEqual(1, len(self.fills))
+        self.assertEqual(u'new', memcache.get(u'shadow\tmodel\trendered_body\tA'))
+        self.assertIsNone(memcache.get(u'lease\tmodel\trendered_body\tA'))
+
+    def test_should_serve_shadow_while_other_request_holds_lease(self):
+        memcache.set(u'shadow\tmodel\trendered_body\tA', u'old')
+        memcache.add(u'lease\tmodel\trendered_body\tA', 1)
+
+        self.assertEqual((u'old', True), caching.fill_rendered_body(u'A', self.fill))
+        self.assertEqual(0, len(self.fills))
+
+    def test_stale_body_should_be_flagged_on_page_which_served_it(self):
+        memcache.set(u'shadow\tmodel\trendered_body\tA', u'old')
+        memcache.add(u'lease\tmodel\trendered_body\tA', 1)
+
+        page = WikiPage.get_by_title(u'A')
+        self.assertEqual(u'old', page.rendered_body)
+        self.assertTrue(page.stale_body_served)
+        self.assertFalse(WikiPage.get_by_title(u'B').stale_body_served)
+
+    def test_should_fill_if_lease_holder_takes_too_long(self):
+        memcache.add(u'lease\tmodel\trendered_body\tA', 1)
+        wait_sec, caching.lease_wait_sec = caching.lease_wait_sec, 0
+        try:
+            self.assertEqual((u'new', False), caching.fill_rendered_body(u'A', self.fill))
+        finally:
+            caching.lease_wait_sec = wait_sec
+        self.assertEqual(1, len(self.fills))
+
+
+class PackedValueTest(AppEngineTestCase):
+    def test_small_value_should_be_stored_as_is(self):
+        caching.set_rendered_body(u'A', u'Hello')
+        self.assertEqual(u'Hello', memcache.get(u'model\trendered_body\tA'))
+
+    def test_large_value_should_be_compressed(self):
+        body = u'Hello world ' * 10000
+        caching.set_rendered_body(u'A', body)
+        caching.create_prc()
+
+        self.assertIsInstance(memcache.get(u'model\trendered_body\tA'), caching._Packed)
+        self.assertEqual(body, caching.get_rendered_body(u'A'))
+
+    def test_value_over_item_limit_should_be_chunked(self):
+        body = os.urandom(2 * 1000 * 1000)
+        caching.set_rendered_body(u'A', body)
+        caching.create_prc()
+
+        header = memcache.get(u'model\trendered_body\tA')
+        self.assertEqual(3, header.chunks)
+        self.assertEqual(body, caching.get_rendered_body(u'A'))
+
+    def test_small_object_should_be_stored_pickled_without_compression(self):
+        caching.set_rendered_fragment(u'A', u'inlinks', [u'B', u'C'])
+        caching.create_prc()
+
+        self.assertFalse(memcache.get(u'model\trendered_fragment\tinlinks\tA').compressed)
+        self.assertEqual([u'B', u'C'], caching.get_rendered_fragment(u'A', u'inlinks'))
+
+    def test_shadow_should_share_chunks_of_filled_value(self):
+        body = os.urandom(2 * 1000 * 1000)
+        caching.fill_rendered_body(u'A', lambda: body)
+
+        header = memcache.get(u'model\trendered_body\tA')
+        self.assertEqual(header.chunk_keys(), memcache.get(u'shadow\tmodel\trendered_body\tA').chunk_keys())
+
+    def test_lost_chunk_should_be_a_miss(self):
+        caching.set_rendered_body(u'A', os.urandom(2 * 1000 * 1000))
+        caching.create_prc()
+
+        memcache.delete(memcache.get(u'model\trendered_body\tA').chunk_keys()[1])
+        self.assertIsNone(caching.get_rendered_body(u'A'))
+
+
+class StatsTest(AppEngineTestCase):
+    def setUp(self):
+        super(StatsTest, self).setUp()
+        caching.stats.flush_all()
+
+    def test_lookups_should_be_counted_per_tier(self):
+        caching.set_rendered_body(u'A', u'Hello')
+        caching.get_rendered_body(u'A')
+        caching.create_prc()
+        caching.get_rendered_body(u'A')
+        caching.get_rendered_body(u'B')
+
+        stats = caching.get_stats()['model\trendered_body']
+        self.assertEqual(1, stats['sets'])
+        self.assertEqual(1, stats['prc_hits'])
+        self.assertEqual(1, stats['memcache_hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(3, stats['rpcs'])
+
+    def test_deletes(self):
+        caching.del_pages([u'A'], ['data', 'metadata'])
+
+        stats = caching.get_stats()
+        self.assertEqual(1, stats['model\tdata']['deletes'])
+        self.assertEqual(1, stats['model\tmetadata']['deletes'])
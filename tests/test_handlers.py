@@ -5,7 +5,7 @@ import main
 import urllib
 import webapp2
 import lxml.etree
-from models import WikiPage
+from models import WikiPage, WikiPageData
 from tests import AppEngineTestCase
 from lxml.html import html5parser
 from google.appengine.ext import testbed
@@ -534,6 +534,72 @@ class PageResourceTest(AppEngineTestCase):
         self.assertEqual(u'*   Hello\n*   [__]', page.body)
 
 
+class ConditionalGetTest(AppEngineTestCase):
+    def setUp(self):
+        super(ConditionalGetTest, self).setUp()
+        self.login('ak@gmail.com', 'ak')
+        self.update_page(u'Hello', u'Test')
+        self.browser = Browser()
+
+    def test_should_respond_validators(self):
+        self.browser.get('/Test')
+        self.assertIsNotNone(self.browser.res.etag)
+
+        self.browser.get('/Test?rev=1')
+        self.assertIsNotNone(self.browser.res.etag)
+        self.assertIsNotNone(self.browser.res.last_modified)
+
+    def test_should_not_respond_last_modified_of_page_with_fragments(self):
+        self.browser.get('/Test')
+        self.assertIsNone(self.browser.res.last_modified)
+
+    def test_if_none_match(self):
+        self.browser.get('/Test')
+        etag = self.browser.res.headers['ETag']
+
+        self.browser.get('/Test', headers={'If-None-Match': etag})
+        self.assertEqual(304, self.browser.res.status_code)
+        self.assertEqual('', self.browser.res.body)
+
+    def test_if_modified_since(self):
+        self.browser.get('/Test?rev=1')
+        last_modified = self.browser.res.headers['Last-Modified']
+
+        self.browser.get('/Test?rev=1', headers={'If-Modified-Since': last_modified})
+        self.assertEqual(304, self.browser.res.status_code)
+
+    def test_if_modified_since_should_be_ignored_for_page_with_fragments(self):
+        self.browser.get('/Test?rev=1')
+        last_modified = self.browser.res.headers['Last-Modified']
+
+        self.update_page(u'[[Test]]', u'Other')
+        self.browser.get('/Test', headers={'If-Modified-Since': last_modified})
+        self.assertEqual(200, self.browser.res.status_code)
+
+    def test_etag_should_differ_by_representation(self):
+        self.browser.get('/Test')
+        etag = self.browser.res.headers['ETag']
+
+        self.browser.get('/Test?_type=json', headers={'If-None-Match': etag})
+        self.assertEqual(200, self.browser.res.status_code)
+
+    def test_updating_page_should_change_etag(self):
+        self.browser.get('/Test')
+        etag = self.browser.res.headers['ETag']
+
+        self.update_page(u'Hello 2', u'Test')
+        self.browser.get('/Test', headers={'If-None-Match': etag})
+        self.assertEqual(200, self.browser.res.status_code)
+
+    def test_adding_inlink_should_change_etag(self):
+        self.browser.get('/Test')
+        etag = self.browser.res.headers['ETag']
+
+        self.update_page(u'[[Test]]', u'Other')
+        self.browser.get('/Test', headers={'If-None-Match': etag})
+        self.assertEqual(200, self.browser.res.status_code)
+
+
 class CustomTemplateTest(AppEngineTestCase):
     def setUp(self):
         super(CustomTemplateTest, self).setUp()
@@ -558,14 +624,77 @@ class SearchResultResourceTest(AppEngineTestCase):
         self.assertEqual('application/json; charset=utf-8', self.browser.res.headers['content-type'])
 
 
+class CacheStatsTest(AppEngineTestCase):
+    def setUp(self):
+        super(CacheStatsTest, self).setUp()
+        self.browser = Browser()
+
+    def test_should_be_admin_only(self):
+        self.login('ak@gmail.com', 'ak')
+        self.browser.get('/sp.cache_stats')
+        self.assertEqual(403, self.browser.res.status_code)
+
+    def test_json(self):
+        self.login('ak@gmail.com', 'ak', is_admin=True)
+        self.update_page(u'Hello', u'Test')
+        self.browser.get('/Test')
+        self.browser.get('/sp.cache_stats?_type=json')
+
+        stats = json.loads(self.browser.res.body)
+        self.assertIn('model\trendered_body', stats['families'])
+        self.assertEqual(0, stats['store_failures'])
+
+
+class ProfilerTest(AppEngineTestCase):
+    def setUp(self):
+        super(ProfilerTest, self).setUp()
+        self.login('ak@gmail.com', 'ak', is_admin=True)
+        self.update_page(u'# Hello', u'Test')
+        self.browser = Browser()
+
+    def test_should_not_profile_by_default(self):
+        self.browser.get('/Test')
+        self.assertNotIn('Server-Timing', self.browser.res.headers)
+
+    def test_server_timing(self):
+        # render the body again instead of using the one stored when saved
+        WikiPageData.delete_by_title(u'Test')
+        self.browser.get('/Test?_profile=1')
+        timing = self.browser.res.headers['Server-Timing']
+        for name in ['datastore', 'memcache', 'markdown', 'toc', 'sanitize', 'template', 'total']:
+            self.assertIn('%s;dur=' % name, timing)
+
+    def test_only_admin_can_profile(self):
+        self.login('ak@gmail.com', 'ak')
+        self.browser.get('/Test?_profile=1')
+        self.assertNotIn('Server-Timing', self.browser.res.headers)
+
+
+class RpcBudgetTest(AppEngineTestCase):
+    def setUp(self):
+        super(RpcBudgetTest, self).setUp()
+        self.login('ak@gmail.com', 'ak')
+        for title in [u'A', u'B', u'C', u'D', u'E', u'F']:
+            self.update_page(u'Hello', title)
+        self.browser = Browser()
+
+    def test_changes(self):
+        with self.assertRpcBudget(datastore=20):
+            self.browser.get('/sp.changes')
+
+    def test_index(self):
+        with self.assertRpcBudget(datastore=20):
+            self.browser.get('/sp.index')
+
+
 class Browser(object):
     def __init__(self):
         self.parser = html5parser.HTMLParser(strict=True)
         self.res = None
         self.tree = None
 
-    def get(self, url, follow_redir=True):
-        req = webapp2.Request.blank(url)
+    def get(self, url, follow_redir=True, headers=None):
+        req = webapp2.Request.blank(url, headers=headers)
         self.res = req.get_response(main.app)
         if len(self.res.body) > 0 and self.res.headers['content-type'].split(';')[0].strip() == 'text/html':
             self.tree = html5parser.fromstring(self.res.body, parser=self.parser)
@@ -1,11 +1,15 @@
 # -*- coding: utf-8 -*-
 import main
+import caching
 import unittest2 as unittest
+from datetime import datetime
 from itertools import groupby
 from tests import AppEngineTestCase
 from google.appengine.api import users
+from google.appengine.ext import ndb
+from google.appengine.datastore import datastore_stub_util
 from markdownext.md_wikilink import parse_wikilinks
-from models import WikiPage, PageOperationMixin, UserPreferences, title_grouper, ConflictError
+from models import WikiPage, WikiLink, PageOperationMixin, UserPreferences, title_grouper, ConflictError, StorageMigration, WikiPageData
 
 
 class PartialUpdateTest(AppEngineTestCase):
@@ -110,6 +114,39 @@ class PageUpdateTest(AppEngineTestCase):
         self.assertEqual(2, len(revs))
 
 
+class DataSnapshotTest(AppEngineTestCase):
+    def setUp(self):
+        super(DataSnapshotTest, self).setUp()
+        self.login('ak@gmail.com', 'ak')
+
+    def test_should_store_parsed_data(self):
+        self.update_page(u'.schema Book\n[[author::AK]]\n\n    #!python\n    print 1', u'Hello')
+        snapshot = WikiPageData.key_for(u'Hello').get()
+        self.assertEqual(1, snapshot.revision)
+        self.assertEqual(u'Book', snapshot.metadata['schema'])
+        self.assertEqual(u'AK', snapshot.data['author'].pvalue)
+        self.assertEqual(['python'], snapshot.hashbangs)
+
+    def test_should_read_snapshot_instead_of_parsing(self):
+        self.update_page(u'.schema Book\n[[author::AK]]', u'Hello')
+        snapshot = WikiPageData.key_for(u'Hello').get()
+        snapshot.data['author'].pvalue = u'TK'
+        snapshot.put()
+        caching.flush_all()
+
+        self.assertEqual(u'TK', WikiPage.get_by_title(u'Hello').data['author'].pvalue)
+
+    def test_should_ignore_snapshot_of_other_revision(self):
+        self.update_page(u'.schema Book\n[[author::AK]]', u'Hello')
+        snapshot = WikiPageData.key_for(u'Hello').get()
+        snapshot.data['author'].pvalue = u'TK'
+        snapshot.revision = 0
+        snapshot.put()
+        caching.flush_all()
+
+        self.assertEqual(u'AK', WikiPage.get_by_title(u'Hello').data['author'].pvalue)
+
+
 class PageValidationTest(AppEngineTestCase):
     def setUp(self):
         super(PageValidationTest, self).setUp()
@@ -302,6 +339,19 @@ class RelatedPageUpdatingTest(AppEngineTestCase):
 
         self.assertEqual({u'C': 0.025, u'D': 0.0125}, page.related_links)
 
+    def test_should_invalidate_related_links_of_walked_pages(self):
+        page = self.update_page(u'[[B]]', u'A')
+        self.update_page(u'[[C]]', u'B')
+        self.update_page(u'Hello', u'C')
+        c = WikiPage.get_by_title(u'C')
+        c.rendered_body
+        self.assertIsNotNone(caching.get_rendered_fragment(u'C', 'related_links'))
+
+        page.update_related_links()
+        caching.create_prc()
+        self.assertIn(u'A', WikiPage.get_by_title(u'C').related_links)
+        self.assertIsNone(caching.get_rendered_fragment(u'C', 'related_links'))
+
     def test_redirect(self):
         page = self.update_page(u'[[B]]', u'A')
         self.update_page(u'.redirect C', u'B')
@@ -478,6 +528,18 @@ class RedirectionTest(AppEngineTestCase):
         self.update_page(u'.redirect C', u'B')
         self.assertRaises(ValueError, self.update_page, u'.redirect A', u'C')
 
+    def test_get_by_titles(self):
+        self.update_page(u'.redirect B', u'A')
+        self.update_page(u'.redirect C', u'B')
+        self.update_page(u'Hello', u'C')
+
+        pages = WikiPage.get_by_titles([u'A', u'D', u'B', u'C'])
+        self.assertEqual([u'C', u'D', u'C', u'C'], [p.title for p in pages])
+        self.assertEqual(0, pages[1].revision)
+
+        pages = WikiPage.get_by_titles([u'A', u'D'], follow_redirect=False)
+        self.assertEqual([u'A', u'D'], [p.title for p in pages])
+
 
 class LinkTest(AppEngineTestCase):
     def setUp(self):
@@ -504,6 +566,26 @@ class LinkTest(AppEngineTestCase):
         self.assertEqual({u'Article/relatedTo': [u'A']}, b.inlinks)
         self.assertEqual({}, b.outlinks)
 
+    def test_inlinks_should_be_stored_as_edges(self):
+        self.update_page(u'[[B]]', u'A')
+        self.assertIsNone(WikiPage._title_key(u'B').get())
+        self.assertEqual([(u'A', u'Article/relatedTo')],
+                         [(e.source, e.rel) for e in WikiLink.query_inlinks(u'B')])
+
+        self.update_page(u'Hello', u'A')
+        self.assertEqual(0, WikiLink.query_inlinks(u'B').count())
+
+    def test_legacy_inlinks(self):
+        WikiPage(key=WikiPage._title_key(u'B'), title=u'B', body=u'', revision=0,
+                 legacy_inlinks={u'Article/relatedTo': [u'X']}, outlinks={}, related_links={}).put()
+        self.update_page(u'[[B]]', u'A')
+        self.assertEqual({u'Article/relatedTo': [u'A', u'X']}, WikiPage.get_by_title(u'B').inlinks)
+
+        WikiPage.migrate_inlinks_to_edges()
+        self.assertIsNone(WikiPage._title_key(u'B').get().legacy_inlinks)
+        self.assertEqual(2, WikiLink.query_inlinks(u'B').count())
+        self.assertEqual({u'Article/relatedTo': [u'A', u'X']}, WikiPage.get_by_title(u'B').inlinks)
+
     def test_wikiquery(self):
         page = self.update_page(u'[[="Article"]]\n[[=schema:"Article"]]')
         self.assertEqual({}, page.outlinks)
@@ -537,6 +619,16 @@ class LinkTest(AppEngineTestCase):
         self.assertEqual({u'Person/birthDate': [u'1979']}, page.outlinks)
         self.assertEqual({u'Person/birthDate': [u'A']}, year.inlinks)
 
+    def test_multiple_rels_to_same_page(self):
+        self.update_page(u'.schema Person\n[[birthDate::1979]]\n[[1979]]', u'A')
+
+        year = WikiPage.get_by_title(u'1979')
+        self.assertEqual({u'Person/birthDate': [u'A'], u'Person/relatedTo': [u'A']}, year.inlinks)
+
+        self.update_page(u'.schema Person\n[[1979]]', u'A')
+        year = WikiPage.get_by_title(u'1979')
+        self.assertEqual({u'Person/relatedTo': [u'A']}, year.inlinks)
+
     def test_add_schema(self):
         self.update_page(u'[[1979]]', u'A')
         self.update_page(u'.schema Book\n[[1979]]', u'A')
@@ -594,6 +686,28 @@ class LinkTest(AppEngineTestCase):
         self.assertEqual({u'Book/datePublished': [u'A', u'B']}, year.inlinks)
 
 
+class EventualConsistencyLinkTest(AppEngineTestCase):
+    # global queries never see writes which haven't been applied yet
+    consistency_policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=0)
+
+    def setUp(self):
+        super(EventualConsistencyLinkTest, self).setUp()
+        self.login('ak@gmail.com', 'ak')
+
+    def test_edges_to_same_page_should_be_root_entities(self):
+        self.update_page(u'[[C]]', u'A')
+        self.update_page(u'[[C]]', u'B')
+
+        edges = ndb.get_multi([WikiLink.key_for(t, u'Article/relatedTo', u'C') for t in [u'A', u'B']])
+        self.assertEqual([None, None], [edge.key.parent() for edge in edges])
+
+    def test_removed_link_should_delete_edge_by_key(self):
+        self.update_page(u'[[B]]', u'A')
+        self.update_page(u'Hello', u'A')
+
+        self.assertIsNone(WikiLink.key_for(u'A', u'Article/relatedTo', u'B').get())
+
+
 class HashbangTest(AppEngineTestCase):
     def setUp(self):
         super(HashbangTest, self).setUp()
@@ -857,6 +971,65 @@ class WikiPageHierarchyTest(AppEngineTestCase):
         self.assertEqual({}, WikiPage.get_by_title(u'GEB/Chapter 1').inlinks)
 
 
+class TitleKeyTest(AppEngineTestCase):
+    def setUp(self):
+        super(TitleKeyTest, self).setUp()
+        self.login('ak@gmail.com', 'ak')
+
+    def test_new_page_should_be_keyed_by_title(self):
+        page = self.update_page(u'Hello', u'A')
+        self.assertEqual(u'A', page.key.string_id())
+        self.assertIsNone(page.key.parent())
+        self.assertEqual(u'Hello', WikiPage._title_key(u'A').get().body)
+
+    def test_get_legacy_page(self):
+        WikiPage(parent=WikiPage._key(), title=u'A', body=u'Hello', revision=1,
+                 outlinks={}, related_links={}).put()
+        self.assertEqual(u'Hello', WikiPage.get_by_title(u'A').body)
+
+    def test_migrate_legacy_page(self):
+        WikiPage(parent=WikiPage._key(), title=u'A', body=u'Hello', revision=1,
+                 outlinks={}, related_links={}).put()
+        WikiPage.migrate_to_title_keys()
+
+        self.assertTrue(StorageMigration.is_finished(WikiPage.title_key_migration))
+        self.assertEqual(1, WikiPage.query().count())
+        self.assertEqual(u'Hello', WikiPage._title_key(u'A').get().body)
+        self.assertEqual(u'Hello', WikiPage.get_by_title(u'A').body)
+
+    def test_migrate_page_keyed_by_title_in_legacy_group(self):
+        WikiPage(key=ndb.Key(WikiPage, u'A', parent=WikiPage._key()), title=u'A', body=u'Hello', revision=1,
+                 outlinks={}, related_links={}).put()
+        WikiPage.migrate_to_title_keys()
+
+        self.assertEqual(1, WikiPage.query().count())
+        self.assertEqual(u'Hello', WikiPage._title_key(u'A').get().body)
+
+
+class RecentChangesTest(AppEngineTestCase):
+    def setUp(self):
+        super(RecentChangesTest, self).setUp()
+        self.login('ak@gmail.com', 'ak')
+
+    def test_changes_should_include_written_through_changes(self):
+        self.update_page(u'Hello', u'A')
+        page = WikiPage.get_by_title(u'B')
+        page.updated_at = datetime.now()
+        caching.add_recent_change(page._recent_change())
+
+        self.assertEqual([u'B', u'A'], [p.title for p in WikiPage.get_changes(None)])
+        self.assertEqual([u'A', u'B'], [p.title for p in WikiPage.get_index()])
+
+    def test_deleted_page_should_be_excluded(self):
+        self.update_page(u'Hello', u'A')
+        page = WikiPage.get_by_title(u'A')
+        page.updated_at = None
+        caching.add_recent_change(page._recent_change())
+
+        self.assertEqual([], WikiPage.get_changes(None))
+        self.assertEqual([], WikiPage.get_index())
+
+
 class WikiPageBugsTest(AppEngineTestCase):
     def test_remove_acl_and_link_at_once_caused_an_error(self):
         self.login('ak@gmail.com', 'ak')
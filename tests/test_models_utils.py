@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
+import threading
 from unittest2 import TestCase
-from models.utils import merge_dicts, pairs_to_dict
+from models.utils import merge_dicts, pairs_to_dict, new_markdown, MarkdownPool
 
 
 class PairsToDictTest(TestCase):
@@ -54,3 +55,42 @@ class MergeDictTest(TestCase):
     def test_force_list(self):
         self.assertEqual({'a': [1], 'b': [2], 'c': [3]},
                          merge_dicts([{'a': 1}, {'b': 2, 'c': 3}], force_list=True))
+
+
+class MarkdownPoolTest(TestCase):
+    def setUp(self):
+        self.pool = MarkdownPool()
+
+    def test_idle_instance_should_be_reused(self):
+        self.pool.convert(u'Hello')
+        self.pool.convert(u'There')
+        self.assertEqual(1, self.pool.idle_count())
+
+    def test_nested_checkout_should_get_another_instance(self):
+        with self.pool.checkout() as outer:
+            with self.pool.checkout() as inner:
+                self.assertIsNot(outer, inner)
+        self.assertEqual(2, self.pool.idle_count())
+
+    def test_references_should_not_leak_into_next_conversion(self):
+        self.pool.convert(u'[AK][a]\n\n[a]: http://x.com')
+        self.assertEqual(u'<p>[AK][a]</p>', self.pool.convert(u'[AK][a]'))
+
+    def test_concurrent_conversions(self):
+        body = u'\n\n'.join(u'# Section %d\n\n[[Page %d]] and [ref][r%d]\n\n[r%d]: http://x.com/%d' % ((i,) * 5)
+                            for i in range(10))
+        expected = new_markdown().convert(body)
+        results = []
+
+        def convert():
+            for _ in range(5):
+                results.append(self.pool.convert(body))
+
+        threads = [threading.Thread(target=convert) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([expected] * 20, results)
+        self.assertLessEqual(self.pool.idle_count(), 4)
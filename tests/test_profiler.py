@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import profiler
+from models import WikiPageData
+from tests import AppEngineTestCase
+
+
+class RpcAuditTest(AppEngineTestCase):
+    def test_rpcs_should_be_counted_per_service(self):
+        with self.assertRpcBudget():
+            WikiPageData.key_for(u'A').get(use_cache=False, use_memcache=False)
+        self.assertEqual({'datastore': 1}, profiler.audit.counts)
+
+    def test_exceeding_budget_should_fail(self):
+        with self.assertRaises(AssertionError):
+            with self.assertRpcBudget(datastore=0):
+                WikiPageData.key_for(u'A').get()
+
+    def test_repeated_single_lookups_should_fail(self):
+        with self.assertRaises(AssertionError):
+            with self.assertRpcBudget():
+                for title in [u'A', u'B', u'C', u'D', u'E']:
+                    WikiPageData.key_for(title).get()
+
+    def test_batched_lookup_should_pass(self):
+        with self.assertRpcBudget(datastore=1):
+            WikiPageData.get_by_titles([u'A', u'B', u'C', u'D', u'E'])
+
+    def test_repeated_lookups_should_be_reported_with_call_site(self):
+        profiler.start_audit()
+        try:
+            for title in [u'A', u'B', u'C', u'D', u'E']:
+                WikiPageData.key_for(title).get(use_memcache=False)
+        finally:
+            profiler.stop_audit()
+
+        [(name, site, count)] = profiler.audit.repeated_lookups()
+        self.assertEqual('datastore', name)
+        self.assertEqual(5, count)
+        self.assertEqual('tests/test_profiler.py', site[0][0])
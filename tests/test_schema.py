@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
+import os
 import schema
 import caching
+import cPickle
+import tempfile
 import unittest2 as unittest
 from tests import AppEngineTestCase
-from models import SchemaDataIndex, PageOperationMixin, WikiPage
+from models import SchemaDataIndex, SchemaDataPosting, PageOperationMixin, WikiPage, StorageMigration
 
 
 class LabelTest(AppEngineTestCase):
@@ -373,6 +376,68 @@ class SchemaIndexTest(AppEngineTestCase):
         self.assertTrue(SchemaDataIndex.has_match(u'Hello', u'isbn', u'1234567890'))
         self.assertTrue(SchemaDataIndex.has_match(u'Hello', u'datePublished', u'2013'))
 
+    def test_rebuild_should_remove_rows_and_postings_of_old_data(self):
+        page = self.update_page(u'.schema Book\n[[author::AK]]', u'Hello')
+        page.body = u'.schema Book\n[[author::TK]]'
+        SchemaDataIndex.rebuild_index(page.title, PageOperationMixin.parse_data(page.title, page.body, u'Book'))
+
+        self.assertFalse(SchemaDataIndex.has_match(u'Hello', u'author', u'AK'))
+        self.assertTrue(SchemaDataIndex.has_match(u'Hello', u'author', u'TK'))
+        self.assertEqual([], SchemaDataPosting.get_titles(u'author', u'AK'))
+        self.assertEqual([u'Hello'], SchemaDataPosting.get_titles(u'author', u'TK'))
+
+    def test_rebuild_should_remove_rows_of_stored_data_by_key(self):
+        page = self.update_page(u'.schema Book\n[[author::AK]]', u'Hello')
+        StorageMigration.finish(SchemaDataIndex.key_migration)
+        SchemaDataIndex.rebuild_index(page.title, PageOperationMixin.parse_data(page.title, u'[[author::TK]]', u'Book'))
+
+        self.assertIsNone(SchemaDataIndex.key_for(u'Hello', u'author', u'AK').get())
+        self.assertEqual([u'Hello'], SchemaDataPosting.get_titles(u'author', u'TK'))
+        self.assertEqual([], SchemaDataPosting.get_titles(u'author', u'AK'))
+
+    def test_deterministic_keys(self):
+        self.update_page(u'.schema Book\n[[author::AK]]', u'Hello')
+        self.assertEqual(u'AK', SchemaDataIndex.key_for(u'Hello', u'author', u'AK').get().value)
+
+        self.update_page(u'.schema Book\n[[author::TK]]', u'Hello')
+        self.assertIsNone(SchemaDataIndex.key_for(u'Hello', u'author', u'AK').get())
+        self.assertEqual(1, SchemaDataIndex.query_by_title(u'Hello').filter(SchemaDataIndex.name == u'author').count())
+
+    def test_update_should_delete_legacy_rows(self):
+        SchemaDataIndex(title=u'Hello', name=u'author', value=u'AK').put()
+        self.update_page(u'.schema Book\n[[author::AK]]', u'Hello')
+        self.update_page(u'.schema Book\n[[author::TK]]', u'Hello')
+        self.assertFalse(SchemaDataIndex.has_match(u'Hello', u'author', u'AK'))
+
+    def test_postings(self):
+        self.update_page(u'.schema Book\n[[author::AK]]', u'Hello')
+        self.update_page(u'.schema Book\n[[author::AK]]', u'Aloha')
+        self.assertEqual([u'Aloha', u'Hello'], SchemaDataPosting.get_titles(u'author', u'AK'))
+
+        self.update_page(u'.schema Book\n[[author::TK]]', u'Hello')
+        self.assertEqual([u'Aloha'], SchemaDataPosting.get_titles(u'author', u'AK'))
+        self.assertEqual([u'Hello'], SchemaDataPosting.get_titles(u'author', u'TK'))
+
+    def test_posting_should_be_sharded_by_title(self):
+        titles = [u'Page %d' % i for i in range(20)]
+        for title in titles:
+            SchemaDataPosting.update(title, [(u'author', u'AK')], [])
+
+        shards = {SchemaDataPosting.shard_of(title) for title in titles}
+        self.assertGreater(len(shards), 1)
+        self.assertEqual(sorted(titles), SchemaDataPosting.get_titles(u'author', u'AK'))
+
+    def test_overflowed_posting_should_fall_back_to_data_index(self):
+        StorageMigration.finish(SchemaDataPosting.migration)
+        max_bytes, SchemaDataPosting.max_bytes = SchemaDataPosting.max_bytes, 1
+        try:
+            self.update_page(u'.schema Book\n[[author::AK]]', u'Hello')
+        finally:
+            SchemaDataPosting.max_bytes = max_bytes
+
+        self.assertIsNone(SchemaDataPosting.get_titles(u'author', u'AK'))
+        self.assertEqual([u'Hello'], SchemaDataIndex.query_titles(u'author', u'AK'))
+
     def test_should_not_index_for_longtext(self):
         self.update_page(u'longDescription::---\n\nHello there', u'Hello')
         self.assertFalse(SchemaDataIndex.has_match(u'Hello', u'longDescription', u'Hello there'))
@@ -524,6 +589,62 @@ class ConversionPriorityTest(unittest.TestCase):
         self.assertEqual(schema.TextProperty, type(prop))
 
 
+class ConversionPlanTest(unittest.TestCase):
+    def test_converters_should_be_ordered_by_priority(self):
+        _, converters = schema.get_conversion_plan(u'SoftwareApplication').get_converters(u'featureList')
+        self.assertEqual([schema.URLProperty, schema.TextProperty], [type_obj for type_obj, _, _ in converters])
+
+    def test_plan_should_be_built_once(self):
+        plan = schema.get_conversion_plan(u'Book')
+        self.assertIs(plan, schema.get_conversion_plan(u'Book'))
+
+        schema.clear_registry()
+        self.assertIsNot(plan, schema.get_conversion_plan(u'Book'))
+
+    def test_unbounded_properties_should_not_be_checked(self):
+        plan = schema.get_conversion_plan(u'Book')
+        self.assertNotIn(u'author', [pname for pname, _, _ in plan.bounds])
+
+    def test_sniffed_out_converters_should_not_be_tried(self):
+        self.assertIsNone(schema.URLProperty.SNIFF.match(u'See http://x.com'))
+        self.assertIsNone(schema.NumberProperty.SNIFF.match(u'Very small'))
+        self.assertIsNotNone(schema.NumberProperty.SNIFF.match(u' 1234.5'))
+        self.assertIsNone(schema.BooleanProperty.SNIFF.match(u'yesterday'))
+
+
+class WireFormatTest(unittest.TestCase):
+    def setUp(self):
+        self.data = schema.SchemaConverter.convert(u'Book', {
+            u'author': [u'AK', u'CK'],
+            u'isbn': u'1234512345',
+            u'datePublished': u'1979-03-??',
+            u'unknownProp': u'Hello',
+        })
+
+    def test_should_restore_typed_data(self):
+        packed = cPickle.loads(cPickle.dumps(schema.pack_data(self.data), cPickle.HIGHEST_PROTOCOL))
+        data = schema.unpack_data(packed)
+
+        del self.data[u'unknownProp']
+        self.assertEqual(self.data, dict((k, v) for k, v in data.items() if k != u'unknownProp'))
+        self.assertEqual(schema.InvalidProperty, type(data[u'unknownProp']))
+        self.assertEqual([u'AK', u'CK'], [v.value for v in data[u'author']])
+        self.assertEqual((1979, 3, 1, False), (data[u'datePublished'].year, data[u'datePublished'].month,
+                                               data[u'datePublished'].day, data[u'datePublished'].bce))
+        self.assertEqual(u'Book', data[u'isbn'].itemtype)
+
+    def test_should_be_smaller_than_pickled_objects(self):
+        self.assertLess(len(cPickle.dumps(schema.pack_data(self.data), cPickle.HIGHEST_PROTOCOL)),
+                        len(cPickle.dumps(self.data, cPickle.HIGHEST_PROTOCOL)))
+
+    def test_data_stored_as_dict_should_be_returned_as_it_is(self):
+        self.assertIs(self.data, schema.unpack_data(self.data))
+
+    def test_property_should_not_have_instance_dict(self):
+        self.assertFalse(hasattr(self.data[u'isbn'], '__dict__'))
+        self.assertEqual(self.data[u'isbn'], cPickle.loads(cPickle.dumps(self.data[u'isbn'], cPickle.HIGHEST_PROTOCOL)))
+
+
 class SchemaChangeTest(AppEngineTestCase):
     def setUp(self):
         super(SchemaChangeTest, self).setUp()
@@ -600,3 +721,49 @@ class MiscTest(AppEngineTestCase):
         self.assertEqual(dict, type(url))
         self.assertEqual([0, 0], url['cardinality'])
         self.assertEqual(['URL'], url['type']['ranges'])
+
+
+class RegistryTest(AppEngineTestCase):
+    def setUp(self):
+        super(RegistryTest, self).setUp()
+        self.compiled_schema = schema.COMPILED_SCHEMA
+        schema.COMPILED_SCHEMA = os.path.join(tempfile.mkdtemp(), 'schema.compiled')
+
+    def tearDown(self):
+        if os.path.exists(schema.COMPILED_SCHEMA):
+            os.remove(schema.COMPILED_SCHEMA)
+        schema.COMPILED_SCHEMA = self.compiled_schema
+        super(RegistryTest, self).tearDown()
+
+    def test_should_be_built_once(self):
+        registry = schema.get_registry()
+        schema.get_schema('Person')
+        self.assertIs(registry, schema.get_registry())
+
+    def test_flush_all_should_clear_registry(self):
+        registry = schema.get_registry()
+        caching.flush_all()
+        self.assertIsNot(registry, schema.get_registry())
+
+    def test_load_compiled_schema(self):
+        schema.write_compiled_schema()
+        schema.clear_registry()
+
+        self.assertEqual(u'People', schema.get_schema('Person')['plural_label'])
+        self.assertEqual(u'Thing/CreativeWork/Book/', schema.get_itemtype_path('Book'))
+
+    def test_compiled_schema_should_be_ignored_if_sources_change(self):
+        schema.write_compiled_schema()
+        schema.SCHEMA_TO_LOAD.append({
+            "types": {
+                "Politician": {
+                    "supertypes": ["Person"],
+                    "specific_properties": [],
+                }
+            }
+        })
+        try:
+            schema.clear_registry()
+            self.assertEqual(u'Thing/Person/Politician/', schema.get_itemtype_path('Politician'))
+        finally:
+            schema.SCHEMA_TO_LOAD = schema.SCHEMA_TO_LOAD[:-1]
@@ -77,3 +77,14 @@ class EvaluationTest(unittest.TestCase):
         expected = [u'C', u'B', u'D', u'A', u'E']
         actual = search.evaluate(positives, negatives).keys()
         self.assertEqual(expected, actual)
+
+
+class SortedListTest(unittest.TestCase):
+    def test_intersect(self):
+        self.assertEqual([2, 5], search.intersect_sorted([1, 2, 3, 5], [2, 4, 5, 6]))
+        self.assertEqual([], search.intersect_sorted([1, 3], [2, 4]))
+        self.assertEqual([7], search.intersect_sorted([7], range(100)))
+
+    def test_union(self):
+        self.assertEqual([1, 2, 3, 4, 5, 6], search.union_sorted([1, 2, 3, 5], [2, 4, 5, 6]))
+        self.assertEqual([1, 2], search.union_sorted([], [1, 2]))
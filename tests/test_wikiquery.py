@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
-from models import WikiPage
+import caching
+from models import WikiPage, WikiPageData
 import unittest2 as unittest
 from tests import AppEngineTestCase
 from google.appengine.api import users
+from google.appengine.api import memcache
 from search import parse_wikiquery as p
 
 
@@ -105,6 +107,29 @@ class EvaluationTest(AppEngineTestCase):
         self.assertEqual(u'1982', result[0]['datePublished'].pvalue)
         self.assertEqual(u'1979', result[1]['datePublished'].pvalue)
 
+    def test_attrs_should_be_served_from_data_snapshot(self):
+        snapshot = WikiPageData.key_for(u'GEB').get()
+        self.assertEqual(u'Douglas Hofstadter', snapshot.data['author'].pvalue)
+
+        snapshot.data['author'].pvalue = u'DH'
+        snapshot.put()
+        self.assertEqual(u'DH', WikiPage.wikiquery(u'"GEB" > author')['author'].pvalue)
+
+    def test_attrs_of_page_without_snapshot(self):
+        WikiPageData.delete_by_title(u'GEB')
+        self.assertEqual(u'Douglas Hofstadter', WikiPage.wikiquery(u'"GEB" > author')['author'].pvalue)
+
+    def test_snapshot_should_be_deleted_before_page_is_saved(self):
+        build = WikiPage._build_data_snapshot
+        WikiPage._build_data_snapshot = lambda *args: 1 / 0
+        try:
+            self.assertRaises(ZeroDivisionError, self.update_page, u'.schema Book\n[[author::DH]]', u'GEB')
+        finally:
+            WikiPage._build_data_snapshot = build
+
+        self.assertIsNone(WikiPageData.key_for(u'GEB').get())
+        self.assertEqual(u'DH', WikiPage.wikiquery(u'"GEB" > author')['author'].pvalue)
+
     def test_logical_operations(self):
         self.assertEqual([{u'name': u'GEB'}, {u'name': u'The Mind\'s I'}],
                          WikiPage.wikiquery(u'"GEB" + "The Mind\'s I"'))
@@ -121,6 +146,60 @@ class EvaluationTest(AppEngineTestCase):
         self.assertEqual(u'The Mind\'s I', result[1]['name'].pvalue)
 
 
+class CacheTest(AppEngineTestCase):
+    def setUp(self):
+        super(CacheTest, self).setUp()
+        self.login('ak@gmail.com', 'ak')
+        self.update_page(u'.schema Book\n[[author::Douglas Hofstadter]]', u'GEB')
+        self.update_page(u'.schema Person', u'Douglas Hofstadter')
+
+    def test_updating_matching_page_should_invalidate_result(self):
+        self.assertEqual(u'Douglas Hofstadter', WikiPage.wikiquery(u'schema:"Book" > author')['author'].pvalue)
+
+        self.update_page(u'.schema Book\n[[author::DH]]', u'GEB')
+        self.assertEqual(u'DH', WikiPage.wikiquery(u'schema:"Book" > author')['author'].pvalue)
+
+    def test_new_matching_page_should_invalidate_result(self):
+        self.assertEqual({u'name': u'GEB'}, WikiPage.wikiquery(u'schema:"Book"'))
+
+        self.update_page(u'.schema Book', u'Brainstorms')
+        self.assertEqual([{u'name': u'Brainstorms'}, {u'name': u'GEB'}], WikiPage.wikiquery(u'schema:"Book"'))
+
+    def test_updating_unrelated_page_should_keep_result(self):
+        WikiPage.wikiquery(u'schema:"Book" > author')
+
+        self.update_page(u'.schema Person\nHello', u'Douglas Hofstadter')
+        snapshot = WikiPageData.key_for(u'GEB').get()
+        snapshot.data['author'].pvalue = u'DH'
+        snapshot.put()
+
+        self.assertEqual(u'Douglas Hofstadter', WikiPage.wikiquery(u'schema:"Book" > author')['author'].pvalue)
+
+    def test_previous_result_should_be_served_while_other_request_evaluates(self):
+        WikiPage.wikiquery(u'schema:"Book" > author')
+        self.update_page(u'.schema Book\n[[author::DH]]', u'GEB')
+
+        # lease and shadow don't change with generations of terms
+        fill_key = caching._wikiquery_fill_key(u'schema:"Book" > author', 'None')
+        memcache.add(u'lease\t%s' % fill_key, 1)
+        caching.create_prc()
+        self.assertEqual(u'Douglas Hofstadter', WikiPage.wikiquery(u'schema:"Book" > author')['author'].pvalue)
+
+    def test_result_with_data_of_redirect_target_should_expire_soon(self):
+        self.update_page(u'.redirect GEB', u'Goedel')
+        stored = []
+        set_cache = caching._set_cache
+        caching._set_cache = lambda key, value, exp_sec=0, shadow_key=None: stored.append((key, exp_sec))
+        try:
+            WikiPage.wikiquery(u'"Goedel" > author')
+            WikiPage.wikiquery(u'"GEB" > author')
+        finally:
+            caching._set_cache = set_cache
+
+        self.assertEqual([caching.wikiquery_redirect_exp_sec, caching.wikiquery_exp_sec],
+                         [exp_sec for key, exp_sec in stored if key.startswith(u'model\twikiquery')])
+
+
 class AclEvaluationTest(AppEngineTestCase):
     def setUp(self):
         super(AclEvaluationTest, self).setUp()
@@ -134,6 +213,14 @@ class AclEvaluationTest(AppEngineTestCase):
     def test_anonymous(self):
         self.assertEqual({u'name': u'A'}, WikiPage.wikiquery(u'schema:"Book" > name'))
 
+    def test_changing_default_permissions_should_change_result(self):
+        self.update_page(u'.schema Book\nThere', u'C')
+        self.update_page(u'service:\n  default_permissions:\n    read: [all]\n    write: [login]', u'.config')
+        self.assertEqual([{u'name': u'A'}, {u'name': u'C'}], WikiPage.wikiquery(u'schema:"Book"'))
+
+        self.update_page(u'service:\n  default_permissions:\n    read: [login]\n    write: [login]', u'.config')
+        self.assertEqual({u'name': u'A'}, WikiPage.wikiquery(u'schema:"Book"'))
+
     def test_user_with_no_permission(self):
         user = users.User('a@y.com')
         self.assertEqual({u'name': u'A'}, WikiPage.wikiquery(u'schema:"Book"', user))
@@ -1,17 +1,39 @@
 # -*- coding: utf-8 -*-
+import main
+import logging
 import webapp2
 import caching
-from models import WikiPage
+import profiler
+from models import WikiPage, get_cur_user, is_admin_user
 from google.appengine.ext import deferred
 from representations import TemplateRepresentation
 from resources import RedirectResource, PageResource, RevisionResource, RevisionListResource,\
     RelatedPagesResource, WikiqueryResource, TitleListResource, SearchResultResource,\
     TitleIndexResource, PostListResource, ChangeListResource, UserPreferencesResource,\
-    SchemaResource
+    SchemaResource, CacheStatsResource
 from ext import ViewExtention
 
 
-class PageHandler(webapp2.RequestHandler):
+class ProfiledRequestHandler(webapp2.RequestHandler):
+    """Handler which reports time spent in each phase of a request if profiling is turned on,
+    and call sites which look up entities one by one if RPCs are audited"""
+    def dispatch(self):
+        profiler.start(main.PROFILE_REQUESTS or
+                       (u'_profile' in self.request.GET and is_admin_user(get_cur_user())))
+        auditing = main.AUDIT_RPCS and profiler.start_audit()
+        try:
+            super(ProfiledRequestHandler, self).dispatch()
+        finally:
+            if profiler.is_enabled():
+                self.response.headers['Server-Timing'] = profiler.server_timing()
+                profiler.log(self.request.path)
+            if auditing:
+                profiler.stop_audit()
+                for report in profiler.format_lookups(profiler.audit.repeated_lookups()):
+                    logging.warning(u'%s: %s' % (self.request.path, report))
+
+
+class PageHandler(ProfiledRequestHandler):
     def head(self, path):
         return self.get(path, True)
 
@@ -50,7 +72,7 @@ class PageHandler(webapp2.RequestHandler):
         resource.delete()
 
 
-class RelatedPagesHandler(webapp2.RequestHandler):
+class RelatedPagesHandler(ProfiledRequestHandler):
     def head(self, path):
         return self.get(path, True)
 
@@ -59,7 +81,7 @@ class RelatedPagesHandler(webapp2.RequestHandler):
         resource.get(head)
 
 
-class WikiqueryHandler(webapp2.RequestHandler):
+class WikiqueryHandler(ProfiledRequestHandler):
     def head(self, path):
         return self.get(path, True)
 
@@ -68,7 +90,7 @@ class WikiqueryHandler(webapp2.RequestHandler):
         resource.get(head)
 
 
-class SpecialPageHandler(webapp2.RequestHandler):
+class SpecialPageHandler(ProfiledRequestHandler):
     def post(self, path):
         method = self.request.GET.get('_method', 'POST')
         if method == 'DELETE':
@@ -113,6 +135,9 @@ class SpecialPageHandler(webapp2.RequestHandler):
         elif path == u'preferences':
             resource = UserPreferencesResource(self.request, self.response)
             resource.get(head)
+        elif path == u'cache_stats':
+            resource = CacheStatsResource(self.request, self.response)
+            resource.get(head)
         elif path.startswith(u'schema/'):
             resource = SchemaResource(self.request, self.response, path)
             resource.get(head)
@@ -133,5 +158,13 @@ class SpecialPageHandler(webapp2.RequestHandler):
             deferred.defer(WikiPage.rebuild_all_data_index, 0)
             self.response.headers['Content-Type'] = 'text/plain; charset=utf-8'
             self.response.write('Done! (queued)')
+        elif path == u'migrate_to_title_keys':
+            deferred.defer(WikiPage.migrate_to_title_keys)
+            self.response.headers['Content-Type'] = 'text/plain; charset=utf-8'
+            self.response.write('Done! (queued)')
+        elif path == u'migrate_inlinks_to_edges':
+            deferred.defer(WikiPage.migrate_inlinks_to_edges)
+            self.response.headers['Content-Type'] = 'text/plain; charset=utf-8'
+            self.response.write('Done! (queued)')
         else:
             self.abort(404)